@@ -1,13 +1,98 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, g, Response, stream_with_context, jsonify, session
 import sqlite3
+import numpy as np
 import pandas as pd
-from io import BytesIO
+from openpyxl import Workbook
+from io import BytesIO, StringIO
+import csv
+import functools
 import os
 import re
-from datetime import datetime
+import json
+import tempfile
+import threading
+from datetime import datetime, date, timedelta
+
+import click
+
+import db
+import excel
+import metrics
+import search
+from cache import LRUCache
+from jobs import JobManager
+from workdays import WorkdayCalendar
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'eleave-secret-key-change-in-production')
+# 数据库路径可通过环境变量 ELEAVE_DB 配置
+app.config['DATABASE'] = os.environ.get('ELEAVE_DB', db.DEFAULT_DB_PATH)
+
+
+# 性能指标（默认关闭）：ELEAVE_METRICS=1 时记录每个请求的耗时、SQL 语句数与耗时并在 /metrics 输出；
+# ELEAVE_SLOW_REQUEST_MS 设定后，超过该耗时的请求连同语句明细写入日志
+METRICS_ENABLED = os.environ.get('ELEAVE_METRICS') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('ELEAVE_SLOW_REQUEST_MS', 0))
+TRACING = METRICS_ENABLED or SLOW_REQUEST_MS > 0
+request_metrics = metrics.default_registry()
+
+
+def _db_pool():
+    # 启用指标时连接池使用计时连接，否则为普通 sqlite3 连接
+    return db.get_pool(app.config['DATABASE'], metrics.TracedConnection if TRACING else sqlite3.Connection)
+
+
+def get_db():
+    """借出当前请求使用的连接（同一请求内复用，请求结束归还连接池）"""
+    if 'db' not in g:
+        g.db = _db_pool().acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        _db_pool().release(conn)
+
+
+@app.before_request
+def start_request_trace():
+    if TRACING and request.endpoint != 'metrics_endpoint':
+        metrics.start_trace()
+
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    """请求结束（流式响应在响应体发送完后）汇总指标，超时的请求写慢请求日志"""
+    trace = metrics.end_trace()
+    if trace is None:
+        return
+    status = 500 if exc is not None else g.get('response_status', 500)
+    slow = SLOW_REQUEST_MS > 0 and trace.elapsed() * 1000 >= SLOW_REQUEST_MS
+    if METRICS_ENABLED:
+        request_metrics.record(trace, request.endpoint or 'none', request.method, status, slow)
+    if slow:
+        app.logger.warning('慢请求 %s', metrics.format_slow_request(trace, f'{request.method} {request.full_path} {status}'))
+
+
+# 导入 / 导出的后台任务（线程池大小可通过环境变量 ELEAVE_JOB_WORKERS 配置）
+jobs = JobManager(max_workers=int(os.environ.get('ELEAVE_JOB_WORKERS', 2)))
+
+
+def _in_app_context(func):
+    """后台线程中执行的函数需要自己的应用上下文才能使用 get_db()"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
 
 # 年度按当前年动态扩展：2023 为起始年，每年只增加当年列（26 年只有 2023–2026，27 年再出现 2027）
 START_YEAR = 2023
@@ -18,31 +103,58 @@ YEARS = _get_years()
 YEAR_COLUMNS = [f'total_days_{y}' for y in YEARS]
 YEAR_COLUMNS_CN = [f'{y}年度总天数' for y in YEARS]
 
-def get_employee_year_slice(employee_row):
-    """从 employee 行元组中取出各年度天数（从第4列起共 len(YEARS) 列）"""
-    return employee_row[3:3 + len(YEARS)]
 
+def refresh_years():
+    """长时间运行的进程跨年时重算年度列表，返回是否发生变化"""
+    global YEARS, YEAR_COLUMNS, YEAR_COLUMNS_CN
+    years = _get_years()
+    if years == YEARS:
+        return False
+    YEARS = years
+    YEAR_COLUMNS = [f'total_days_{y}' for y in YEARS]
+    YEAR_COLUMNS_CN = [f'{y}年度总天数' for y in YEARS]
+    return True
 
-def normalize_employee_row(employee_row):
-    """保证 employee 行与当前 YEAR_COLUMNS 数量一致，不足的年度列补 0（兼容迁移前旧表）"""
-    if not employee_row or len(employee_row) < 3:
-        return employee_row
-    base = list(employee_row[:3])
-    year_vals = list(employee_row[3:])
-    while len(year_vals) < len(YEAR_COLUMNS):
-        year_vals.append(0)
-    return tuple(base + year_vals[: len(YEAR_COLUMNS)])
 
-# Initialize database
-def init_db():
-    conn = sqlite3.connect('leave_management.db')
-    c = conn.cursor()
-    year_cols_sql = ', '.join(f'{col} REAL NOT NULL DEFAULT 0' for col in YEAR_COLUMNS)
-    c.execute(f'''CREATE TABLE IF NOT EXISTS Employees (
+# 年度总天数保存在 EmployeeEntitlements (employee_id, year, days)；
+# 页面与 Excel 仍按 YEARS 展开成宽表：工号、姓名、邮箱 + 各年度天数
+def _entitlement_cte(employee_filter='1'):
+    """把当前 YEARS 的年度天数透视成宽表 CTE：ent(employee_id, y0, y1, ...)，只读取这些年度"""
+    cols = ', '.join(f'SUM(CASE WHEN year = {int(y)} THEN days END) AS y{i}' for i, y in enumerate(YEARS))
+    return f'''ent AS (
+        SELECT employee_id, {cols} FROM EmployeeEntitlements
+        WHERE year BETWEEN {int(YEARS[0])} AND {int(YEARS[-1])} AND {employee_filter}
+        GROUP BY employee_id)'''
+
+
+def _entitlement_columns_sql():
+    return ', '.join(f'COALESCE(ent.y{i}, 0)' for i in range(len(YEARS)))
+
+
+def fetch_employee(c, employee_id):
+    """(工号, 姓名, 邮箱, 各年度天数...)；员工不存在返回 None"""
+    c.execute(f'''WITH {_entitlement_cte('employee_id = ?')}
+        SELECT e.id, e.name, e.email, {_entitlement_columns_sql()}
+        FROM Employees e LEFT JOIN ent ON ent.employee_id = e.id
+        WHERE e.id = ?''', (employee_id, employee_id))
+    return c.fetchone()
+
+
+def save_entitlements(c, rows):
+    """批量写入 (employee_id, year, days)，已存在的年度覆盖"""
+    c.executemany('''INSERT INTO EmployeeEntitlements (employee_id, year, days) VALUES (?, ?, ?)
+                     ON CONFLICT(employee_id, year) DO UPDATE SET days = excluded.days''', rows)
+
+
+def _form_entitlements(employee_id):
+    return [(employee_id, y, float(request.form.get(col, 0) or 0)) for y, col in zip(YEARS, YEAR_COLUMNS)]
+
+# 数据库结构迁移：按版本号顺序执行，已执行的版本记录在 schema_version 表中
+def _migration_001_base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS Employees (
         id INTEGER PRIMARY KEY,
         name TEXT NOT NULL,
-        email TEXT NOT NULL,
-        {year_cols_sql})''')
+        email TEXT NOT NULL)''')
     c.execute('''CREATE TABLE IF NOT EXISTS LeaveRecords (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_id INTEGER,
@@ -54,97 +166,980 @@ def init_db():
         leave_type TEXT,
         remark TEXT,
         FOREIGN KEY(employee_id) REFERENCES Employees(id))''')
+
+
+def _migration_002_leave_ledger(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS LeaveBalances (
+        employee_id INTEGER PRIMARY KEY,
+        total_days REAL NOT NULL DEFAULT 0,
+        used_days REAL NOT NULL DEFAULT 0)''')
+    c.execute('ALTER TABLE LeaveRecords ADD COLUMN remaining_after REAL')
+
+
+def _migration_003_leave_employee_index(c):
+    # 员工详情 / 所有休假记录 / 导出都按员工取记录并按申请时间排序
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_records_employee ON LeaveRecords(employee_id, application_time, id)')
+
+
+# 导入按 (员工, 申请时间, 休假信息) 去重。旧版新增休假在日期或天数留空时把休假信息存为 ''，
+# 同一申请时间的不同休假因此键值相同，只对休假信息非空的记录去重。
+# 已有数据里可能存在真正的重复记录，用普通索引而不是唯一索引：迁移不会因此失败，
+# 重复记录照常保留，写入时由导入的 NOT EXISTS 与 _check_duplicate_leave 去重
+def leave_dedup_conflicts(c):
+    """已有的去重键重复的记录，返回 [(工号, 申请时间, 休假信息, '记录号, 记录号'), ...]"""
+    c.execute('''SELECT employee_id, application_time, leave_info, group_concat(id, ', ')
+        FROM LeaveRecords
+        WHERE leave_info <> '' AND employee_id IS NOT NULL AND application_time IS NOT NULL
+        GROUP BY employee_id, application_time, leave_info HAVING COUNT(*) > 1
+        ORDER BY employee_id, application_time''')
+    return c.fetchall()
+
+
+def _migration_004_leave_dedup_index(c):
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_records_dedup ON LeaveRecords(employee_id, application_time, leave_info)')
+    conflicts = leave_dedup_conflicts(c)
+    if conflicts:
+        app.logger.warning('%d 组休假记录的 (工号, 申请时间, 休假信息) 重复，已保留，'
+                           '运行 flask leave-duplicates 查看：%s', len(conflicts),
+                           '; '.join(f'工号 {emp} {applied} 记录 {ids}' for emp, applied, _, ids in conflicts[:20]))
+
+
+def _migration_005_employee_entitlements(c):
+    # 每年一列 total_days_YYYY 改为 (员工, 年度, 天数) 行；WITHOUT ROWID 表按主键聚簇，按员工取各年度即覆盖查询
+    c.execute('''CREATE TABLE IF NOT EXISTS EmployeeEntitlements (
+        employee_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        days REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (employee_id, year)) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_entitlements_year ON EmployeeEntitlements(year, employee_id, days)')
+    wide = [row[1] for row in c.execute('PRAGMA table_info(Employees)') if re.fullmatch(r'total_days_\d{4}', row[1])]
+    for col in wide:
+        c.execute(f'INSERT OR REPLACE INTO EmployeeEntitlements (employee_id, year, days) SELECT id, {int(col[-4:])}, {col} FROM Employees')
+    for col in wide:
+        c.execute(f'ALTER TABLE Employees DROP COLUMN {col}')
+
+
+def _migration_006_leave_typed_dates(c):
+    # start_date / end_date 是 '2024-1-3 上午' 这样的文本，无法按日期比较或走索引；
+    # 拆成 ISO 日期 + 上午/下午 两列，原文本列保留用于展示与编辑
+    for col in ('start_on', 'start_period', 'end_on', 'end_period'):
+        c.execute(f'ALTER TABLE LeaveRecords ADD COLUMN {col} TEXT')
+    df = pd.DataFrame(c.execute('SELECT id, start_date, end_date FROM LeaveRecords').fetchall(),
+                      columns=['id', 'start_date', 'end_date'])
+    dates = leave_date_columns(df['start_date'], df['end_date'])
+    c.executemany('UPDATE LeaveRecords SET start_on=?, start_period=?, end_on=?, end_period=? WHERE id=?',
+                  dates.assign(id=df['id']).itertuples(index=False, name=None))
+    # 区间查询 end_on >= 起 AND start_on <= 止：近期 / 未来的区间只扫描索引尾部
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_records_period ON LeaveRecords(end_on, start_on)')
+
+
+
+def _migration_007_data_version(c):
+    # 数据版本号：每次写入 +1，页面缓存与 ETag 据此失效
+    c.execute('''CREATE TABLE IF NOT EXISTS Meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO Meta (key, value) VALUES ('data_version', 0)")
+
+
+
+def _migration_008_holidays(c):
+    # 节假日表：法定假日 is_workday=0，调休上班的周末 is_workday=1；未列出的日期按周一至周五为工作日
+    c.execute('''CREATE TABLE IF NOT EXISTS Holidays (
+        day TEXT PRIMARY KEY,
+        name TEXT,
+        is_workday INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID''')
+    # 日历按区间取回员工与上午/下午，覆盖索引免去逐行回表；取代只含日期的 idx_leave_records_period
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_leave_records_calendar
+                 ON LeaveRecords(end_on, start_on, employee_id, start_period, end_period, leave_type)''')
+    c.execute('DROP INDEX IF EXISTS idx_leave_records_period')
+
+
+def _migration_009_rollovers(c):
+    # 年度结转明细：每名员工每个年度一行，expired 为结转时超出上限作废的天数，从总天数中扣除
+    c.execute('''CREATE TABLE IF NOT EXISTS Rollovers (
+        employee_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        balance_before REAL NOT NULL,
+        carried_over REAL NOT NULL,
+        expired REAL NOT NULL DEFAULT 0,
+        entitlement REAL NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (employee_id, year)) WITHOUT ROWID''')
+
+
+def _migration_010_leave_summary(c):
+    # 每名员工每个年度一行的汇总（年度天数、当年已休年假 / 其他假、截至年末的累计剩余），
+    # 由 refresh_ledger() 随台账一起维护；首页按年度排序分页直接读取
+    c.execute('''CREATE TABLE IF NOT EXISTS LeaveSummary (
+        employee_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        entitled REAL NOT NULL DEFAULT 0,
+        annual_used REAL NOT NULL DEFAULT 0,
+        other_used REAL NOT NULL DEFAULT 0,
+        remaining REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (employee_id, year)) WITHOUT ROWID''')
+    # 常用排序各建一个以年度开头的索引（WITHOUT ROWID 表的索引隐含主键，工号作次序无需再排序）
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_summary_year ON LeaveSummary(year, employee_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_summary_remaining ON LeaveSummary(year, remaining)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_leave_summary_annual_used ON LeaveSummary(year, annual_used)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_employees_name ON Employees(name)')
+
+
+def _migration_011_leave_search(c):
+    # 休假记录全文索引（rowid = LeaveRecords.id），文本经 search.fts_tokens() 逐字切分汉字后写入。
+    # 触发器只把变化的记录号记入 LeaveSearchPending（纯 SQL，sqlite3 命令行等任何连接仍可直接写这两张表），
+    # 由 sync_search_index() 补写索引；更新台账（remaining_after）不触发。现有记录全部待写入，随启动检查的台账重建写入
+    c.execute('CREATE VIRTUAL TABLE IF NOT EXISTS LeaveSearch USING fts5(leave_info, remark, leave_type, name, email)')
+    c.execute('CREATE TABLE IF NOT EXISTS LeaveSearchPending (id INTEGER PRIMARY KEY)')
+    c.execute('INSERT OR IGNORE INTO LeaveSearchPending (id) SELECT id FROM LeaveRecords')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS leave_search_insert AFTER INSERT ON LeaveRecords BEGIN
+        INSERT OR IGNORE INTO LeaveSearchPending (id) VALUES (NEW.id);
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS leave_search_update
+        AFTER UPDATE OF leave_info, remark, leave_type, employee_id ON LeaveRecords BEGIN
+        INSERT OR IGNORE INTO LeaveSearchPending (id) VALUES (NEW.id);
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS leave_search_delete AFTER DELETE ON LeaveRecords BEGIN
+        INSERT OR IGNORE INTO LeaveSearchPending (id) VALUES (OLD.id);
+    END''')
+    # 员工改名 / 改邮箱时重写其全部记录（导入 upsert 未改动姓名邮箱的员工不触发）；新建员工时补上此前已存在的记录
+    c.execute('''CREATE TRIGGER IF NOT EXISTS leave_search_employee_update AFTER UPDATE OF name, email ON Employees
+        WHEN OLD.name IS NOT NEW.name OR OLD.email IS NOT NEW.email BEGIN
+        INSERT OR IGNORE INTO LeaveSearchPending (id) SELECT id FROM LeaveRecords WHERE employee_id = NEW.id;
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS leave_search_employee_insert AFTER INSERT ON Employees BEGIN
+        INSERT OR IGNORE INTO LeaveSearchPending (id) SELECT id FROM LeaveRecords WHERE employee_id = NEW.id;
+    END''')
+
+
+MIGRATIONS = [
+    (1, 'base tables', _migration_001_base_tables),
+    (2, 'leave balance ledger', _migration_002_leave_ledger),
+    (3, 'leave records employee index', _migration_003_leave_employee_index),
+    (4, 'leave records dedup index', _migration_004_leave_dedup_index),
+    (5, 'employee entitlements table', _migration_005_employee_entitlements),
+    (6, 'leave records typed dates', _migration_006_leave_typed_dates),
+    (7, 'data version', _migration_007_data_version),
+    (8, 'holidays', _migration_008_holidays),
+    (9, 'rollovers', _migration_009_rollovers),
+    (10, 'leave summary', _migration_010_leave_summary),
+    (11, 'leave search', _migration_011_leave_search),
+]
+
+
+# Initialize database：启动检查，执行未应用的迁移
+# 迁移步骤只改结构、搬数据，不调用业务代码；有迁移执行过就整体重建一次台账
+def init_db():
+    conn = get_db()
+    c = conn.cursor()
+    # 跨年后首次启动检查时汇总表还没有当年的行，同样整体重建一次
+    if db.apply_migrations(conn, MIGRATIONS) or not c.execute(
+            'SELECT 1 FROM LeaveSummary WHERE year = ? LIMIT 1', (YEARS[-1],)).fetchone():
+        refresh_ledger(c)
+        bump_data_version(c)
+        conn.commit()
+
+
+_schema_lock = threading.Lock()
+_schema_checked = None  # (数据库路径, 年份)：已完成启动检查的组合
+
+
+@app.before_request
+def check_schema():
+    """每个进程首次请求（及跨年后首次请求）时做一次启动检查，其余请求只比较一个元组"""
+    global _schema_checked
+    key = (app.config['DATABASE'], datetime.now().year)
+    if _schema_checked == key:
+        return
+    with _schema_lock:
+        if _schema_checked != key:
+            refresh_years()
+            init_db()
+            _schema_checked = key
+
+
+# 页面 / 导出缓存：以数据版本号为界，写入路由在提交前调用 bump_data_version()
+view_cache = LRUCache(max_entries=int(os.environ.get('ELEAVE_CACHE_ENTRIES', 256)),
+                      max_bytes=int(os.environ.get('ELEAVE_CACHE_BYTES', 64 * 1024 * 1024)))
+
+
+def data_version(c):
+    return c.execute("SELECT value FROM Meta WHERE key = 'data_version'").fetchone()[0]
+
+
+def bump_data_version(c):
+    """标记数据已变化；与写入在同一事务内提交"""
+    c.execute("UPDATE Meta SET value = value + 1 WHERE key = 'data_version'")
+
+
+_workday_calendars = {}  # 数据库路径 -> (节假日版本号, WorkdayCalendar)
+
+
+def workday_calendar(c):
+    """当前数据库的工作日历：进程内只加载一次，导入节假日（版本号变化）后重新加载"""
+    row = c.execute("SELECT value FROM Meta WHERE key = 'holidays_version'").fetchone()
+    version = row[0] if row else 0
+    cached = _workday_calendars.get(app.config['DATABASE'])
+    if cached is None or cached[0] != version:
+        calendar = WorkdayCalendar.from_rows(c.execute('SELECT day, is_workday FROM Holidays').fetchall())
+        cached = _workday_calendars[app.config['DATABASE']] = (version, calendar)
+    return cached[1]
+
+
+def cached_view(view):
+    """缓存 GET 响应体并附带 ETag，客户端带 If-None-Match 且未变化时返回 304
+
+    流式响应（csv / ndjson）、非 200 响应以及有待显示 flash 消息的请求不缓存。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+        # 日期参与版本：默认区间（如「下周」）与年度列随日期变化
+        version = (data_version(get_db().cursor()), date.today())
+        key = request.full_path
+        hit = view_cache.get(key, version)
+        if hit is not None:
+            body, headers = hit
+            return Response(body, headers=headers).make_conditional(request)
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.content_length is None \
+                or response.content_length > view_cache.max_bytes:
+            return response
+        response.direct_passthrough = False
+        response.add_etag()
+        body = response.get_data()
+        view_cache.put(key, (body, list(response.headers.items())), len(body), version)
+        return response.make_conditional(request)
+    return wrapper
+
+
+# 年假台账：LeaveBalances 保存每名员工的总天数 / 已休年假天数，
+# LeaveRecords.remaining_after 保存按申请时间排序到该条记录为止的剩余年假。
+# 所有写入路由在同一事务内调用 refresh_ledger()，页面与导出直接读取，无需逐条重算。
+LEDGER_ORDER = 'application_time, id'
+
+
+def _annual_days_sql(alias=''):
+    """计入年假消耗的天数表达式（仅 年假 且天数 > 0）"""
+    p = f'{alias}.' if alias else ''
+    return f"CASE WHEN {p}leave_type = '年假' AND {p}days > 0 THEN {p}days ELSE 0 END"
+
+
+# 总天数 = 各年度天数合计 − 年度结转时作废的天数
+_TOTAL_DAYS_SQL = ('COALESCE((SELECT SUM(en.days) FROM EmployeeEntitlements en WHERE en.employee_id = e.id), 0)'
+                   ' - COALESCE((SELECT SUM(r.expired) FROM Rollovers r WHERE r.employee_id = e.id), 0)')
+
+
+def _expected_ledger_sql(employee_filter):
+    """从头重算台账的查询：返回 (员工总数 CTE, 每条记录期望剩余天数 CTE)"""
+    totals = f'''totals AS (
+        SELECT e.id AS employee_id, {_TOTAL_DAYS_SQL} AS total_days,
+               COALESCE((SELECT SUM({_annual_days_sql('lr')}) FROM LeaveRecords lr WHERE lr.employee_id = e.id), 0) AS used_days
+        FROM Employees e WHERE {employee_filter.format(col='e.id')})'''
+    expected = f'''expected AS (
+        SELECT lr.id, lr.employee_id,
+               COALESCE(t.total_days, 0) - SUM({_annual_days_sql('lr')})
+                   OVER (PARTITION BY lr.employee_id ORDER BY lr.application_time, lr.id) AS remaining_after
+        FROM LeaveRecords lr LEFT JOIN totals t ON t.employee_id = lr.employee_id
+        WHERE {employee_filter.format(col='lr.employee_id')})'''
+    return totals, expected
+
+
+def _employee_filter(employee_ids):
+    if employee_ids is None:
+        return '1', ()
+    return '{col} IN (SELECT value FROM json_each(?))', (json.dumps([int(i) for i in employee_ids]),)
+
+
+def refresh_ledger(c, employee_ids=None):
+    """重算指定员工（默认全部）的台账；调用方负责提交事务"""
+    employee_filter, params = _employee_filter(employee_ids)
+    totals, expected = _expected_ledger_sql(employee_filter)
+    c.execute(f'''WITH {totals}
+        INSERT INTO LeaveBalances (employee_id, total_days, used_days)
+        SELECT employee_id, total_days, used_days FROM totals WHERE 1
+        ON CONFLICT(employee_id) DO UPDATE SET total_days = excluded.total_days, used_days = excluded.used_days''',
+              params)
+    c.execute(f'''WITH {totals}, {expected}
+        UPDATE LeaveRecords SET remaining_after = expected.remaining_after
+        FROM expected WHERE LeaveRecords.id = expected.id''', params * 2)
+    refresh_summary(c, employee_filter, params)
+    sync_search_index(c)
+
+
+def sync_search_index(c):
+    """把 LeaveSearchPending 中的记录（重新）写入全文索引，已删除的记录只移出索引；返回处理的记录数，调用方负责提交事务"""
+    pending = c.execute('SELECT COUNT(*) FROM LeaveSearchPending').fetchone()[0]
+    if not pending:
+        return 0
+    c.execute('DELETE FROM LeaveSearch WHERE rowid IN (SELECT id FROM LeaveSearchPending)')
+    # 另开游标逐行读取，边读边写，全量重建时不把整表载入内存
+    source = c.connection.cursor()
+    source.execute('''SELECT lr.id, lr.leave_info, lr.remark, lr.leave_type, e.name, e.email
+        FROM LeaveSearchPending p
+        JOIN LeaveRecords lr ON lr.id = p.id
+        LEFT JOIN Employees e ON e.id = lr.employee_id''')
+    c.executemany('INSERT INTO LeaveSearch (rowid, leave_info, remark, leave_type, name, email) VALUES (?, ?, ?, ?, ?, ?)',
+                  ((row[0], *map(search.fts_tokens, row[1:])) for row in source))
+    c.execute('DELETE FROM LeaveSearchPending')
+    return pending
+
+
+# 休假记录所属年度：开始日期的年份，没有开始日期时取申请时间；都没有的归入 0 年度（计入各年度累计剩余）
+_LEAVE_YEAR_SQL = 'COALESCE(CAST(substr(COALESCE(start_on, application_time), 1, 4) AS INTEGER), 0)'
+
+
+def refresh_summary(c, employee_filter, params):
+    """重建指定员工的 LeaveSummary：当前 YEARS 以及有年度天数 / 休假记录 / 结转的年度各一行"""
+    f = employee_filter.format
+    c.execute(f"DELETE FROM LeaveSummary WHERE {f(col='employee_id')}", params)
+    c.execute(f'''
+        WITH usage AS (
+            SELECT employee_id, {_LEAVE_YEAR_SQL} AS year, SUM({_annual_days_sql()}) AS annual_used,
+                   SUM(CASE WHEN leave_type = '年假' THEN 0 WHEN days > 0 THEN days ELSE 0 END) AS other_used
+            FROM LeaveRecords WHERE {f(col='employee_id')}
+            GROUP BY employee_id, year),
+        keys AS (
+            SELECT e.id AS employee_id, y.value AS year FROM Employees e, json_each(?) y WHERE {f(col='e.id')}
+            UNION SELECT employee_id, year FROM EmployeeEntitlements WHERE {f(col='employee_id')}
+            UNION SELECT employee_id, year FROM Rollovers WHERE {f(col='employee_id')}
+            UNION SELECT employee_id, year FROM usage)
+        INSERT INTO LeaveSummary (employee_id, year, entitled, annual_used, other_used, remaining)
+        SELECT k.employee_id, k.year, COALESCE(en.days, 0), COALESCE(u.annual_used, 0), COALESCE(u.other_used, 0),
+               SUM(COALESCE(en.days, 0) - COALESCE(r.expired, 0) - COALESCE(u.annual_used, 0))
+                   OVER (PARTITION BY k.employee_id ORDER BY k.year)
+        FROM keys k
+        LEFT JOIN EmployeeEntitlements en ON en.employee_id = k.employee_id AND en.year = k.year
+        LEFT JOIN Rollovers r ON r.employee_id = k.employee_id AND r.year = k.year
+        LEFT JOIN usage u ON u.employee_id = k.employee_id AND u.year = k.year
+        WHERE k.employee_id IN (SELECT id FROM Employees)
+    ''', (*params, json.dumps(YEARS), *params * 3))
+
+
+def compute_remaining_days(df):
+    """向量化计算每条记录之后的剩余年假天数
+
+    df 需含 employee_id / total_days / leave_type / days 列，并已按员工、申请时间排序；
+    只有 年假 且天数 > 0 的记录计入消耗，按员工分组累加后从总天数中扣除。
+    """
+    annual = df['days'].where((df['leave_type'] == '年假') & (df['days'] > 0), 0).fillna(0)
+    return df['total_days'].fillna(0) - annual.groupby(df['employee_id'], sort=False, dropna=False).cumsum()
+
+
+def verify_ledger(c):
+    """不写入，比较已保存的台账与从头重算的结果，返回偏差列表 [(类型, 员工, 记录, 已存, 期望)]
+
+    每条记录的剩余天数用 pandas 独立重算（compute_remaining_days），
+    不复用写入台账时的 SQL，避免同一处错误在校验中被掩盖。
+    """
+    totals, _ = _expected_ledger_sql('1')
+    c.execute(f'''WITH {totals}
+        SELECT 'balance', t.employee_id, NULL, lb.total_days, t.total_days FROM totals t
+        LEFT JOIN LeaveBalances lb ON lb.employee_id = t.employee_id
+        WHERE lb.total_days IS NULL OR abs(lb.total_days - t.total_days) > 1e-9
+        UNION ALL
+        SELECT 'used', t.employee_id, NULL, lb.used_days, t.used_days FROM totals t
+        LEFT JOIN LeaveBalances lb ON lb.employee_id = t.employee_id
+        WHERE lb.used_days IS NULL OR abs(lb.used_days - t.used_days) > 1e-9''')
+    drift = c.fetchall()
+    df = pd.read_sql_query(f'''
+        SELECT lr.id, lr.employee_id, {_TOTAL_DAYS_SQL} AS total_days, lr.leave_type, lr.days, lr.remaining_after
+        FROM LeaveRecords lr LEFT JOIN Employees e ON e.id = lr.employee_id
+        ORDER BY lr.employee_id, lr.application_time, lr.id
+    ''', c.connection)
+    df['expected'] = compute_remaining_days(df)
+    bad = df[df['remaining_after'].isna() | ((df['remaining_after'] - df['expected']).abs() > 1e-9)]
+    drift += [('record', int(r.employee_id), int(r.id), None if pd.isna(r.remaining_after) else r.remaining_after, r.expected)
+              for r in bad.itertuples(index=False)]
+    return drift
+
+
+def _report_drift(drift, limit=20):
+    click.echo(f'台账偏差 {len(drift)} 处')
+    for kind, emp_id, leave_id, stored, expected in drift[:limit]:
+        target = f'员工 {emp_id}' + (f' 记录 {leave_id}' if leave_id is not None else '')
+        click.echo(f'  [{kind}] {target}: 已存 {stored} / 期望 {expected}')
+    if len(drift) > limit:
+        click.echo(f'  ……其余 {len(drift) - limit} 处省略')
+
+
+@app.cli.command('ledger-verify')
+def ledger_verify_command():
+    """从头重算年假台账并报告与已保存数据的偏差（不修改数据库）"""
+    init_db()
+    drift = verify_ledger(get_db().cursor())
+    _report_drift(drift)
+    if drift:
+        raise SystemExit(1)
+
+
+@app.cli.command('ledger-rebuild')
+def ledger_rebuild_command():
+    """从头重建年假台账，并报告重建前的偏差"""
+    init_db()
+    conn = get_db()
+    c = conn.cursor()
+    _report_drift(verify_ledger(c))
+    refresh_ledger(c)
+    bump_data_version(c)
     conn.commit()
-    conn.close()
+    click.echo('台账已重建')
+
 
-# 对已有数据库做迁移：仅追加当前 YEARS 中缺失的年度列（当年才加当年列）
-def migrate_db():
-    conn = sqlite3.connect('leave_management.db')
+@app.cli.command('holidays-import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def holidays_import_command(path):
+    """导入节假日（xlsx / csv，列：日期、名称、是否上班），已存在的日期覆盖"""
+    init_db()
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path, engine='openpyxl')
+    df = df.rename(columns={'日期': 'day', '名称': 'name', '是否上班': 'is_workday'})
+    if 'day' not in df.columns:
+        raise click.ClickException('缺少「日期」列')
+    days = pd.to_datetime(df['day'], errors='coerce')
+    if days.isna().any():
+        raise click.ClickException(f"无法解析的日期，Excel 行号: {', '.join(map(str, days.index[days.isna()] + 2))}")
+    is_workday = df['is_workday'].isin([1, True, '1', '是']) if 'is_workday' in df.columns else pd.Series(False, index=df.index)
+    rows = pd.DataFrame({
+        'day': days.dt.strftime('%Y-%m-%d'),
+        'name': _clean_text(df['name']) if 'name' in df.columns else None,
+        'is_workday': is_workday.astype(int),
+    }).astype(object)
+    conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='Employees'")
-    if not c.fetchone():
-        conn.close()
+    c.executemany('''INSERT INTO Holidays (day, name, is_workday) VALUES (?, ?, ?)
+                     ON CONFLICT(day) DO UPDATE SET name=excluded.name, is_workday=excluded.is_workday''',
+                  rows.where(rows.notna(), None).itertuples(index=False, name=None))
+    c.execute("""INSERT INTO Meta (key, value) VALUES ('holidays_version', 1)
+                 ON CONFLICT(key) DO UPDATE SET value = value + 1""")
+    bump_data_version(c)
+    conn.commit()
+    click.echo(f'已导入 {len(rows)} 个日期')
+
+
+@app.cli.command('leave-duplicates')
+def leave_duplicates_command():
+    """列出 (工号, 申请时间, 休假信息) 重复的休假记录，供人工删除或修改"""
+    init_db()
+    conflicts = leave_dedup_conflicts(get_db().cursor())
+    if not conflicts:
+        click.echo('没有重复的休假记录')
+        return
+    click.echo(f'{len(conflicts)} 组休假记录的 (工号, 申请时间, 休假信息) 重复：')
+    for employee_id, applied, info, ids in conflicts:
+        click.echo(f'  员工 {employee_id} 申请时间 {applied} {info}: 记录 {ids}')
+    raise SystemExit(1)
+
+
+@app.cli.command('recompute-days')
+@click.option('--dry-run', is_flag=True, help='只列出差异，不写入')
+def recompute_days_command(dry_run):
+    """按起止日期与工作日历重算所有休假记录的天数，同步更新「已休年假信息」中的天数并重建台账"""
+    init_db()
+    conn = get_db()
+    c = conn.cursor()
+    df = pd.read_sql_query('''
+        SELECT id, employee_id, leave_info, start_on, start_period = '下午' AS start_pm,
+               end_on, end_period = '上午' AS end_am, days
+        FROM LeaveRecords WHERE start_on IS NOT NULL AND end_on IS NOT NULL
+    ''', c.connection)
+    df['new_days'] = workday_calendar(c).leave_days(df['start_on'].to_numpy('datetime64[D]'), df['start_pm'],
+                                                    df['end_on'].to_numpy('datetime64[D]'), df['end_am'])
+    old = pd.to_numeric(df['days'], errors='coerce')
+    changed = df[old.isna() | ~np.isclose(old.fillna(0), df['new_days'])]
+    click.echo(f'共 {len(df)} 条有起止日期的记录，{len(changed)} 条天数与工作日计算不一致')
+    for row in changed.head(20).itertuples():
+        click.echo(f'  员工 {row.employee_id} 记录 {row.id}: {row.days} -> {row.new_days:g}')
+    if changed.empty:
+        return
+    # NULL 的休假信息读成 NaN，原样写回 NULL
+    leave_info = [_replace_days(info, d) if isinstance(info, str) else None
+                  for info, d in zip(changed['leave_info'], changed['new_days'])]
+    collisions = _dedup_collisions(c, dict(zip(changed['id'].tolist(), leave_info)))
+    if collisions:
+        click.echo(f'{len(collisions)} 组记录改写天数后 (工号, 申请时间, 休假信息) 重复，请先修改或删除其中一条'
+                   + ('' if dry_run else '，未写入任何记录') + '：')
+        for (employee_id, applied, info), ids in collisions[:20]:
+            click.echo(f'  员工 {employee_id} 申请时间 {applied} {info}: 记录 {", ".join(map(str, ids))}')
+        if not dry_run:
+            raise SystemExit(1)
+    if dry_run:
+        return
+    c.executemany('UPDATE LeaveRecords SET days=?, leave_info=? WHERE id=?',
+                  zip(changed['new_days'].tolist(), leave_info, changed['id'].tolist()))
+    refresh_ledger(c, changed['employee_id'].unique().tolist())
+    bump_data_version(c)
+    conn.commit()
+    click.echo(f'已更新 {len(changed)} 条记录')
+
+
+def _dedup_collisions(c, new_leave_info):
+    """按 {记录号: 新休假信息} 改写后，在去重键 (工号, 申请时间, 休假信息) 上重复的记录
+
+    返回 [((工号, 申请时间, 休假信息), [记录号, ...]), ...]；只检查参与去重的记录（休假信息非空）。
+    """
+    keys = {}
+    c.execute("SELECT id, employee_id, application_time, leave_info FROM LeaveRecords "
+              "WHERE employee_id IS NOT NULL AND application_time IS NOT NULL")
+    for leave_id, employee_id, applied, info in c.fetchall():
+        info = new_leave_info.get(leave_id, info)
+        if info:
+            keys.setdefault((employee_id, applied, info), []).append(leave_id)
+    return sorted((key, ids) for key, ids in keys.items()
+                  if len(ids) > 1 and any(i in new_leave_info for i in ids))
+
+
+# 年度结转：新年度开始时按上年末剩余年假结转（超出上限的部分作废），并一次性写入所有员工的新年度天数。
+# 台账本身按累计口径计算（总天数 − 已休），结转不需要搬动天数，只需记录作废部分。
+ROLLOVER_REPORT_HEADER = ['工号', '姓名', '上年末剩余', '结转', '作废', '工龄(年)', '新年度天数', '原新年度天数']
+
+
+def parse_tiers(text):
+    """'0:5,10:10,20:15' -> ([0, 10, 20], [5.0, 10.0, 15.0])，按工龄升序"""
+    try:
+        tiers = sorted((int(k), float(v)) for k, v in (part.split(':') for part in text.split(',') if part.strip()))
+    except ValueError:
+        raise ValueError(f'工龄档位格式应为「年限:天数,年限:天数」，如 0:5,10:10,20:15：{text}')
+    if not tiers:
+        raise ValueError('工龄档位为空')
+    return [t[0] for t in tiers], [t[1] for t in tiers]
+
+
+def plan_rollover(c, year, cap=None, days=None, tiers=None, overwrite=False):
+    """计算 year 年度的结转方案（不写入），每名员工一行：
+    employee_id / name / balance_before / carried_over / expired / seniority / entitlement / current_entitlement
+
+    上年末剩余 = year 之前的年度天数合计 − 之前结转作废的天数 − 开始日期早于 year 年的年假天数；
+    cap 为最多结转天数（None 不设上限），透支（负数）照常结转。
+    新年度天数：指定 days 时统一为该值；指定 tiers 时按工龄档位（系统中没有入职日期，
+    工龄按最早有年度天数的年份起算）；否则沿用上一年度天数。不指定 overwrite 时保留已填写的非零值。
+    """
+    df = pd.read_sql_query(f'''
+        SELECT e.id AS employee_id, e.name,
+               COALESCE((SELECT SUM(en.days) FROM EmployeeEntitlements en
+                         WHERE en.employee_id = e.id AND en.year < :year), 0)
+             - COALESCE((SELECT SUM(r.expired) FROM Rollovers r WHERE r.employee_id = e.id AND r.year < :year), 0)
+             - COALESCE((SELECT SUM({_annual_days_sql('lr')}) FROM LeaveRecords lr
+                         WHERE lr.employee_id = e.id AND COALESCE(lr.start_on, lr.application_time) < :start), 0)
+               AS balance_before,
+               (SELECT MIN(en.year) FROM EmployeeEntitlements en WHERE en.employee_id = e.id AND en.days > 0) AS first_year,
+               (SELECT en.days FROM EmployeeEntitlements en WHERE en.employee_id = e.id AND en.year = :year - 1) AS previous,
+               (SELECT en.days FROM EmployeeEntitlements en WHERE en.employee_id = e.id AND en.year = :year)
+               AS current_entitlement
+        FROM Employees e ORDER BY e.id
+    ''', c.connection, params={'year': year, 'start': f'{year}-01-01'})
+    balance = df['balance_before'].astype(float)
+    df['carried_over'] = balance if cap is None else balance.clip(upper=cap)
+    df['expired'] = balance - df['carried_over']
+    df['seniority'] = (year - df['first_year']).clip(lower=0).fillna(0).astype('int64')
+    if days is not None:
+        entitlement = pd.Series(float(days), index=df.index)
+    elif tiers is not None:
+        thresholds, values = tiers
+        idx = np.searchsorted(thresholds, df['seniority'], side='right') - 1
+        entitlement = pd.Series(np.where(idx >= 0, np.take(values, idx.clip(min=0)), 0.0), index=df.index)
+    else:
+        entitlement = df['previous'].astype(float).fillna(0)
+    current = df['current_entitlement'].astype(float)
+    df['entitlement'] = entitlement if overwrite else current.where(current > 0, entitlement)
+    return df.drop(columns=['first_year', 'previous'])
+
+
+def apply_rollover(c, year, plan):
+    """写入结转方案：新年度天数、结转明细（同一年度重复执行时覆盖），并重建台账；调用方负责提交事务"""
+    ids = plan['employee_id'].tolist()
+    save_entitlements(c, zip(ids, [year] * len(ids), plan['entitlement'].tolist()))
+    c.execute('DELETE FROM Rollovers WHERE year = ?', (year,))
+    now = datetime.now().isoformat(timespec='seconds')
+    c.executemany('''INSERT INTO Rollovers (employee_id, year, balance_before, carried_over, expired, entitlement, created_at)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  zip(ids, [year] * len(ids), plan['balance_before'].tolist(), plan['carried_over'].tolist(),
+                      plan['expired'].tolist(), plan['entitlement'].tolist(), [now] * len(ids)))
+    refresh_ledger(c)
+    bump_data_version(c)
+
+
+@app.cli.command('rollover')
+@click.argument('year', type=int, required=False)
+@click.option('--cap', type=float, help='最多结转天数，超出部分作废（默认不设上限）')
+@click.option('--days', type=float, help='新年度天数统一设为该值')
+@click.option('--tiers', help='按工龄设定新年度天数，如 0:5,10:10,20:15（满 0 年 5 天，满 10 年 10 天，满 20 年 15 天）')
+@click.option('--overwrite', is_flag=True, help='覆盖已填写的新年度天数（默认只填写为 0 或未填写的员工）')
+@click.option('--dry-run', is_flag=True, help='只输出预览，不写入')
+@click.option('--report', type=click.Path(dir_okay=False), help='逐人明细写入 .xlsx / .csv 文件')
+def rollover_command(year, cap, days, tiers, overwrite, dry_run, report):
+    """年度结转：按上年末剩余年假结转（可设上限），并在一个事务内写入所有员工的新年度天数"""
+    year = year or date.today().year
+    if year > date.today().year and not dry_run:
+        raise click.ClickException(f'{year} 年度尚未开始，只能 --dry-run 预览')
+    if days is not None and tiers:
+        raise click.ClickException('--days 与 --tiers 只能指定一个')
+    try:
+        tiers = parse_tiers(tiers) if tiers else None
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    init_db()
+    conn = get_db()
+    c = conn.cursor()
+    plan = plan_rollover(c, year, cap, days, tiers, overwrite)
+    click.echo(f'{year} 年度结转：{len(plan)} 名员工，结转 {plan["carried_over"].sum():g} 天，'
+               f'作废 {plan["expired"].sum():g} 天（{int((plan["expired"] > 0).sum())} 人），'
+               f'新年度天数合计 {plan["entitlement"].sum():g} 天')
+    for row in plan[plan['expired'] > 0].head(20).itertuples():
+        click.echo(f'  员工 {row.employee_id} {row.name}: 剩余 {row.balance_before:g}，结转 {row.carried_over:g}，作废 {row.expired:g}')
+    if report:
+        rows = plan[['employee_id', 'name', 'balance_before', 'carried_over', 'expired', 'seniority', 'entitlement',
+                     'current_entitlement']].astype(object)
+        with open(report, 'wb') as output:
+            write_export(output, 'csv' if report.lower().endswith('.csv') else 'xlsx', ROLLOVER_REPORT_HEADER,
+                         rows.where(rows.notna(), None).itertuples(index=False, name=None))
+        click.echo(f'明细已写入 {report}')
+    if dry_run:
         return
-    c.execute('PRAGMA table_info(Employees)')
-    existing = {row[1] for row in c.fetchall()}
-    for col in YEAR_COLUMNS:
-        if col not in existing:
-            c.execute(f'ALTER TABLE Employees ADD COLUMN {col} REAL NOT NULL DEFAULT 0')
+    apply_rollover(c, year, plan)
     conn.commit()
-    conn.close()
+    click.echo('已写入')
+
+# Homepage：员工列表直接读取 LeaveSummary，按年度显示已休 / 剩余，支持搜索（工号 / 姓名 / 邮箱）、排序与分页
+INDEX_PER_PAGE = 50
+INDEX_MAX_PER_PAGE = 200
+INDEX_SORTS = {
+    'id': 's.employee_id', 'name': 'e.name', 'entitled': 's.entitled',
+    'annual_used': 's.annual_used', 'other_used': 's.other_used', 'remaining': 's.remaining',
+}
+
 
-# Homepage
 @app.route('/')
+@cached_view
 def index():
-    if os.path.exists('leave_management.db'):
-        migrate_db()
-    conn = sqlite3.connect('leave_management.db')
+    year = request.args.get('year', YEARS[-1], type=int)
+    year = year if year in YEARS else YEARS[-1]
+    sort = request.args.get('sort', 'id')
+    sort = sort if sort in INDEX_SORTS else 'id'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    q = request.args.get('q', '').strip()
+    per_page = max(1, min(request.args.get('per_page', INDEX_PER_PAGE, type=int), INDEX_MAX_PER_PAGE))
+    where, params = ['s.year = ?'], [year]
+    if q:
+        if q.isdigit():
+            where.append('(e.id = ? OR e.name LIKE ? OR e.email LIKE ?)')
+            params += [int(q), f'%{q}%', f'%{q}%']
+        else:
+            where.append('(e.name LIKE ? OR e.email LIKE ?)')
+            params += [f'%{q}%', f'%{q}%']
+    where = ' AND '.join(where)
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT * FROM Employees')
-    employees = [normalize_employee_row(r) for r in c.fetchall()]
-    conn.close()
-    return render_template('index.html', employees=employees, year_columns_cn=YEAR_COLUMNS_CN, num_years=len(YEARS))
+    count_from = 'LeaveSummary s JOIN Employees e ON e.id = s.employee_id' if q else 'LeaveSummary s'
+    total = c.execute(f'SELECT COUNT(*) FROM {count_from} WHERE {where}', params).fetchone()[0]
+    pages = max(1, -(-total // per_page))
+    page = max(1, min(request.args.get('page', 1, type=int), pages))
+    # 按工号以外的列排序时以工号为第二排序键，保证分页顺序稳定
+    order_by = f'{INDEX_SORTS[sort]} {order}' + (f', s.employee_id {order}' if sort != 'id' else '')
+    c.execute(f'''SELECT e.id, e.name, e.email, s.annual_used, s.other_used, s.remaining
+        FROM LeaveSummary s JOIN Employees e ON e.id = s.employee_id
+        WHERE {where}
+        ORDER BY {order_by}
+        LIMIT ? OFFSET ?''', params + [per_page, (page - 1) * per_page])
+    rows = c.fetchall()
+    # 本页员工的各年度天数取自同一张汇总表
+    c.execute('''SELECT employee_id, year, entitled FROM LeaveSummary
+                 WHERE employee_id IN (SELECT value FROM json_each(?)) AND year BETWEEN ? AND ?''',
+              (json.dumps([r[0] for r in rows]), YEARS[0], YEARS[-1]))
+    entitled = {(employee_id, y): days for employee_id, y, days in c.fetchall()}
+    employees = [(*r[:3], *(entitled.get((r[0], y), 0) for y in YEARS), *r[3:]) for r in rows]
+    args = {'q': q, 'year': year, 'sort': sort, 'order': order, 'per_page': per_page}
+    return render_template('index.html', employees=employees, year_columns_cn=YEAR_COLUMNS_CN, num_years=len(YEARS),
+                           years=YEARS, args=args, page=page, pages=pages, total=total)
 
 # Employee detail page
 @app.route('/employee/<int:employee_id>')
+@cached_view
 def employee(employee_id):
-    conn = sqlite3.connect('leave_management.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT * FROM Employees WHERE id=?', (employee_id,))
-    employee = c.fetchone()
+    employee = fetch_employee(c, employee_id)
     if employee is None:
-        conn.close()
         return "员工不存在", 404
-    employee = normalize_employee_row(employee)
-    total_annual_days = sum(get_employee_year_slice(employee))
-    c.execute('SELECT id, leave_info, application_time, leave_type, remark, days FROM LeaveRecords WHERE employee_id=? ORDER BY application_time ASC', (employee_id,))
+    # 总天数与剩余天数直接读取台账；总天数已扣除结转作废的天数，并包含 YEARS 以外年度的天数
+    total_annual_days, expired_days = c.execute('''
+        SELECT COALESCE((SELECT total_days FROM LeaveBalances WHERE employee_id = ?), 0),
+               COALESCE((SELECT SUM(expired) FROM Rollovers WHERE employee_id = ?), 0)''',
+        (employee_id, employee_id)).fetchone()
+    c.execute(f'SELECT id, leave_info, application_time, leave_type, remark, days, remaining_after FROM LeaveRecords WHERE employee_id=? ORDER BY {LEDGER_ORDER}', (employee_id,))
     leave_records = c.fetchall()
-    # Calculate remaining days for each record
-    leave_records_with_remaining = []
-    remaining_days = total_annual_days
-    for record in leave_records:
-        days = record[5] if record[5] is not None else 0
-        if record[3] == '年假' and days > 0:
-            remaining_days -= days
-        leave_records_with_remaining.append(record + (remaining_days,))
-    conn.close()
-    return render_template('employee.html', employee=employee, leave_records=leave_records_with_remaining, total_annual_days=total_annual_days, year_columns_cn=YEAR_COLUMNS_CN, num_years=len(YEARS))
-
-# All leave records page
+    return render_template('employee.html', employee=employee, leave_records=leave_records, total_annual_days=total_annual_days,
+                           expired_days=expired_days, year_columns_cn=YEAR_COLUMNS_CN, num_years=len(YEARS))
+
+# All leave records page：按工号做 keyset 分页（每页固定员工数），筛选条件在 SQL 中完成
+ALL_LEAVES_PER_PAGE = 50
+ALL_LEAVES_MAX_PER_PAGE = 200
+
+
+def _all_leaves_filters(args):
+    """解析筛选参数，返回 (员工条件 SQL, 参数, 记录条件 SQL, 参数, 回显用的筛选值)"""
+    filters = {k: args.get(k, '').strip() for k in ('employee', 'leave_type', 'date_from', 'date_to')}
+    emp_sql, emp_params = [], []
+    if filters['employee']:
+        if filters['employee'].isdigit():
+            emp_sql.append('(e.id = ? OR e.name LIKE ?)')
+            emp_params += [int(filters['employee']), f"%{filters['employee']}%"]
+        else:
+            emp_sql.append('e.name LIKE ?')
+            emp_params.append(f"%{filters['employee']}%")
+    rec_sql, rec_params = [], []
+    if filters['leave_type']:
+        rec_sql.append('lr.leave_type = ?')
+        rec_params.append(filters['leave_type'])
+    # 按休假日期筛选：与 [起, 止] 有交集的记录（ISO 日期列，走 idx_leave_records_calendar）
+    if filters['date_from']:
+        rec_sql.append('lr.end_on >= ?')
+        rec_params.append(filters['date_from'])
+    if filters['date_to']:
+        rec_sql.append('lr.start_on <= ?')
+        rec_params.append(filters['date_to'])
+    return ' AND '.join(emp_sql), emp_params, ' AND '.join(rec_sql), rec_params, filters
+
+
 @app.route('/all_leaves')
+@cached_view
 def all_leaves():
-    conn = sqlite3.connect('leave_management.db')
+    after = request.args.get('after', 0, type=int)
+    per_page = max(1, min(request.args.get('per_page', ALL_LEAVES_PER_PAGE, type=int), ALL_LEAVES_MAX_PER_PAGE))
+    emp_sql, emp_params, rec_sql, rec_params, filters = _all_leaves_filters(request.args)
+    page_where = ['e.id > ?'] + ([emp_sql] if emp_sql else [])
+    page_params = [after] + emp_params
+    if rec_sql:
+        # 有记录筛选时只列出存在匹配记录的员工
+        page_where.append(f'EXISTS (SELECT 1 FROM LeaveRecords lr WHERE lr.employee_id = e.id AND {rec_sql})')
+        page_params += rec_params
+    join_filter = f' AND {rec_sql}' if rec_sql else ''
+    conn = get_db()
     c = conn.cursor()
-    c.execute('''
-        SELECT e.id, e.name, lr.id as leave_id, lr.leave_info, lr.application_time, lr.leave_type, lr.remark, lr.days
-        FROM Employees e
-        LEFT JOIN LeaveRecords lr ON e.id = lr.employee_id
-        ORDER BY e.id, lr.application_time ASC
-    ''')
+    # 单条查询：先取一页员工（多取一个用于判断是否有下一页），再连接台账与休假记录
+    c.execute(f'''
+        WITH page AS (
+            SELECT e.id, e.name FROM Employees e
+            WHERE {' AND '.join(page_where)}
+            ORDER BY e.id LIMIT ?
+        )
+        SELECT p.id, p.name, COALESCE(lb.total_days, 0), lr.id as leave_id, lr.leave_info, lr.application_time,
+               lr.leave_type, lr.remark, lr.days, lr.remaining_after
+        FROM page p
+        LEFT JOIN LeaveBalances lb ON lb.employee_id = p.id
+        LEFT JOIN LeaveRecords lr ON p.id = lr.employee_id{join_filter}
+        ORDER BY p.id, lr.application_time ASC, lr.id ASC
+    ''', page_params + [per_page + 1] + rec_params)
     leave_records = c.fetchall()
-    # Group records by employee
+    # Group records by employee（总天数与剩余天数均来自台账）
     employees_leaves = {}
     for record in leave_records:
         emp_id = record[0]
         if emp_id not in employees_leaves:
-            employees_leaves[emp_id] = {'name': record[1], 'leaves': [], 'total_annual_days': 0}
-        if record[2]:  # Check if leave_id exists (not NULL)
-            employees_leaves[emp_id]['leaves'].append(list(record[2:]))
-    # Calculate total and remaining days
-    cols = ', '.join(YEAR_COLUMNS)
-    for emp_id in employees_leaves:
-        c.execute(f'SELECT {cols} FROM Employees WHERE id=?', (emp_id,))
-        totals = c.fetchone()
-        total_annual_days = sum(totals) if totals else 0
-        employees_leaves[emp_id]['total_annual_days'] = total_annual_days
-        remaining_days = total_annual_days
-        for leave in employees_leaves[emp_id]['leaves']:
-            days = leave[5] if leave[5] is not None else 0
-            if leave[3] == '年假' and days > 0:
-                remaining_days -= days
-            leave.append(remaining_days)
-    conn.close()
-    return render_template('all_leaves.html', employees_leaves=employees_leaves)
+            if len(employees_leaves) == per_page:
+                break
+            employees_leaves[emp_id] = {'name': record[1], 'leaves': [], 'total_annual_days': record[2]}
+        if record[3]:  # Check if leave_id exists (not NULL)
+            employees_leaves[emp_id]['leaves'].append(list(record[3:]))
+    has_next = len({r[0] for r in leave_records}) > per_page
+    next_after = next(reversed(employees_leaves)) if has_next else None
+    return render_template('all_leaves.html', employees_leaves=employees_leaves, filters=filters,
+                           per_page=per_page, after=after, next_after=next_after)
+
+# Search：休假信息、备注、假期类型与员工姓名 / 邮箱的全文检索（LeaveSearch），按 bm25 相关度排序分页
+SEARCH_PER_PAGE = 50
+SEARCH_MAX_PER_PAGE = 200
+SEARCH_WEIGHTS = (1.0, 2.0, 0.5, 3.0, 2.0)  # bm25 列权重：leave_info, remark, leave_type, name, email
+# 相关度要对每条匹配记录打分后排序（30 万条中匹配 24 万条的「年假」约 0.5s）；匹配数超过该值时
+# 各记录得分已几乎无差别，改按录入顺序倒序（最新在前），FTS5 按 rowid 顺序产出匹配，取一页即可停止
+SEARCH_RANK_MAX = 20000
+
+
+def search_leaves(c, q, leave_type=None, limit=SEARCH_PER_PAGE, offset=0):
+    """返回 (匹配总数, 本页记录, 是否按相关度排序)；q 中没有可检索的内容时返回 None"""
+    match = search.match_query(q)
+    if match is None:
+        return None
+    where, params = ['LeaveSearch MATCH ?'], [match]
+    if leave_type:
+        where.append('lr.leave_type = ?')
+        params.append(leave_type)
+    where = ' AND '.join(where)
+    # 与日历、谁在休假一致，员工已不存在的记录不列出；计数与取页使用同一组连接
+    joins = '''JOIN LeaveRecords lr ON lr.id = LeaveSearch.rowid
+        JOIN Employees e ON e.id = lr.employee_id'''
+    total = c.execute(f'SELECT COUNT(*) FROM LeaveSearch {joins} WHERE {where}', params).fetchone()[0]
+    ranked = total <= SEARCH_RANK_MAX
+    order = (f"bm25(LeaveSearch, {', '.join(map(str, SEARCH_WEIGHTS))}), lr.id" if ranked
+             else 'LeaveSearch.rowid DESC')
+    c.execute(f'''SELECT lr.id, lr.employee_id, e.name, lr.leave_info, lr.application_time, lr.leave_type,
+               lr.remark, lr.days, lr.remaining_after
+        FROM LeaveSearch {joins}
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?''', params + [limit, offset])
+    return total, c.fetchall(), ranked
+
+
+def _sync_before_search(conn, c):
+    # 应用内的写入已在各自事务中补写索引；这里补上其他连接（如 sqlite3 命令行）直接改动的记录。
+    # 外部改动不提升数据版本号，检索页因此不进页面缓存（检索本身只需几毫秒），每次都先补写
+    if sync_search_index(c):
+        conn.commit()
+
+
+@app.route('/search')
+def search_page():
+    q = request.args.get('q', '').strip()
+    leave_type = request.args.get('leave_type', '').strip()
+    per_page = max(1, min(request.args.get('per_page', SEARCH_PER_PAGE, type=int), SEARCH_MAX_PER_PAGE))
+    page = max(1, request.args.get('page', 1, type=int))
+    conn = get_db()
+    c = conn.cursor()
+    _sync_before_search(conn, c)
+    result = search_leaves(c, q, leave_type, per_page, (page - 1) * per_page) if q else None
+    total, records, ranked = result or (0, [], True)
+    pages = max(1, -(-total // per_page))
+    args = {'q': q, 'leave_type': leave_type, 'per_page': per_page}
+    return render_template('search.html', records=records, total=total, page=page, pages=pages, args=args,
+                           searched=result is not None, ranked=ranked)
+
+# Who is off：指定日期区间内休假的员工，默认下周（周一至周日）
+def _parse_iso_date(value, default):
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return default
+
+
+@app.route('/who_is_off')
+@cached_view
+def who_is_off():
+    next_monday = date.today() + timedelta(days=7 - date.today().weekday())
+    date_from = _parse_iso_date(request.args.get('date_from', '').strip(), next_monday)
+    date_to = _parse_iso_date(request.args.get('date_to', '').strip(), date_from + timedelta(days=6))
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''
+        SELECT e.id, e.name, lr.start_on, lr.start_period, lr.end_on, lr.end_period, lr.leave_type, lr.days, lr.remark
+        FROM LeaveRecords lr JOIN Employees e ON e.id = lr.employee_id
+        WHERE lr.end_on >= ? AND lr.start_on <= ?
+        ORDER BY lr.start_on, lr.start_period, e.id
+    ''', (date_from.isoformat(), date_to.isoformat()))
+    return render_template('who_is_off.html', records=c.fetchall(),
+                           date_from=date_from.isoformat(), date_to=date_to.isoformat())
+
+# 休假日历：把每条休假的起止日期（含上午/下午）展开成逐日占用，统计每天的休假人数与人天
+CALENDAR_MAX_DAYS = 3 * 366
+WEEKDAY_CN = '一二三四五六日'
+
+
+def calendar_days(c, start, end):
+    """start~end（含两端）的 datetime64[D] 数组及对应的工作日掩码"""
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    return days, workday_calendar(c).is_workday(days)
+
+
+def leave_calendar(c, start, end, leave_type=None, workdays_only=False):
+    """start~end 每天一行：date / weekday / is_workday / people（休假人数）/ person_days（人天）/ names
+
+    只读取与区间有交集的记录（走 idx_leave_records_calendar），用 numpy 一次性把区间展开到天：
+    开始于下午的首日、结束于上午的末日各记 0.5 天；同一员工同一天多条记录合计不超过 1 天。
+    """
+    days, workday = calendar_days(c, start, end)
+    n = len(days)
+    where, params = ['lr.end_on >= ?', 'lr.start_on <= ?'], [start.isoformat(), end.isoformat()]
+    if leave_type:
+        where.append('lr.leave_type = ?')
+        params.append(leave_type)
+    # 日期直接在 SQL 中换算成相对 start 的天数，取回的全是整数；与 who_is_off 一样只统计员工仍存在的记录
+    c.execute(f'''
+        SELECT e.id,
+               CAST(julianday(lr.start_on) - julianday(?) AS INTEGER), lr.start_period IS '下午',
+               CAST(julianday(lr.end_on) - julianday(?) AS INTEGER), lr.end_period IS '上午'
+        FROM LeaveRecords lr JOIN Employees e ON e.id = lr.employee_id
+        WHERE {' AND '.join(where)}
+    ''', [start.isoformat(), start.isoformat(), *params])
+    employee_id, start_off, start_pm, end_off, end_am = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 5).T
+    lo, hi = np.maximum(start_off, 0), np.minimum(end_off, n - 1)
+    lengths = np.where(hi >= lo, hi - lo + 1, 0)
+    # 每条记录重复 length 次，再加上组内序号得到逐日偏移
+    rec_idx = np.repeat(np.arange(len(lengths)), lengths)
+    day_off = np.repeat(lo, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    weight = (1.0
+              - 0.5 * ((day_off == start_off[rec_idx]) & (start_pm[rec_idx] == 1))
+              - 0.5 * ((day_off == end_off[rec_idx]) & (end_am[rec_idx] == 1)))
+    keep = weight > 0
+    if workdays_only:
+        keep &= workday[day_off]
+    # 按 (员工, 日) 去重：pairs 按员工、日期排序
+    pairs, inverse = np.unique(employee_id[rec_idx[keep]] * n + day_off[keep], return_inverse=True)
+    pair_weight = np.minimum(np.bincount(inverse, weights=weight[keep], minlength=len(pairs)), 1.0)
+    pair_emp, pair_day = pairs // n, pairs % n
+    # 姓名只查本区间涉及的员工，再按日期分组
+    c.execute('SELECT id, name FROM Employees WHERE id IN (SELECT value FROM json_each(?))',
+              (json.dumps(np.unique(pair_emp).tolist()),))
+    name_of = pd.Series(dict(c.fetchall()), dtype=object)
+    labels = name_of.reindex(pair_emp).to_numpy()
+    labels = np.where(pair_weight < 1, labels + '(半天)', labels)
+    order = np.argsort(pair_day, kind='stable')
+    per_day = np.split(labels[order], np.cumsum(np.bincount(pair_day, minlength=n))[:-1])
+    out = pd.DataFrame({
+        'date': np.datetime_as_string(days),
+        'weekday': [WEEKDAY_CN[d] for d in (days.astype(np.int64) + 3) % 7],  # 1970-01-01 为周四
+        'is_workday': workday,
+        'people': np.bincount(pair_day, minlength=n),
+        'person_days': np.bincount(pair_day, weights=pair_weight, minlength=n).astype(float),
+        'names': [list(names) for names in per_day],
+    })
+    return out[out['is_workday']].reset_index(drop=True) if workdays_only else out
+
+
+def _calendar_args():
+    """解析日历查询参数，默认本月；返回 (起, 止, 假期类型, 仅工作日) 或错误消息"""
+    today = date.today()
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    start = _parse_iso_date(request.args.get('date_from', '').strip(), month_start)
+    end = _parse_iso_date(request.args.get('date_to', '').strip(), next_month - timedelta(days=1))
+    if end < start:
+        return "结束日期不能早于开始日期"
+    if (end - start).days >= CALENDAR_MAX_DAYS:
+        return f"日期区间不能超过 {CALENDAR_MAX_DAYS} 天"
+    return start, end, request.args.get('leave_type', '').strip() or None, request.args.get('workdays') == '1'
+
+
+@app.route('/calendar')
+@cached_view
+def calendar():
+    args = _calendar_args()
+    if isinstance(args, str):
+        return args, 400
+    start, end, leave_type, workdays_only = args
+    days = leave_calendar(get_db().cursor(), start, end, leave_type, workdays_only)
+    return render_template('calendar.html', days=days.itertuples(index=False),
+                           date_from=start.isoformat(), date_to=end.isoformat(),
+                           leave_type=leave_type or '', workdays=workdays_only)
+
+
+@app.route('/calendar/export')
+@cached_view
+def export_calendar():
+    fmt = request.args.get('format', 'xlsx')
+    if fmt not in EXPORT_FORMATS:
+        return f"不支持的导出格式: {fmt}", 400
+    args = _calendar_args()
+    if isinstance(args, str):
+        return args, 400
+    start, end, leave_type, workdays_only = args
+    days = leave_calendar(get_db().cursor(), start, end, leave_type, workdays_only)
+    days['is_workday'] = days['is_workday'].map({True: '是', False: '否'})
+    days['names'] = days['names'].str.join('、')
+    header = ['日期', '星期', '工作日', '休假人数', '休假人天', '休假人员']
+    rows = days.astype(object).itertuples(index=False, name=None)
+    return _export_response(header, rows, f'leave_calendar_{start.isoformat()}_{end.isoformat()}')
+
 
 # Add employee
 @app.route('/add_employee', methods=['GET', 'POST'])
@@ -153,143 +1148,207 @@ def add_employee():
         id = request.form['id']
         name = request.form['name']
         email = request.form['email']
-        year_values = [float(request.form.get(col, 0) or 0) for col in YEAR_COLUMNS]
-        conn = sqlite3.connect('leave_management.db')
+        conn = get_db()
         c = conn.cursor()
-        placeholders = ', '.join(['?'] * (3 + len(YEAR_COLUMNS)))
-        cols = 'id, name, email, ' + ', '.join(YEAR_COLUMNS)
         try:
-            c.execute(f'INSERT INTO Employees ({cols}) VALUES ({placeholders})',
-                      (id, name, email, *year_values))
+            c.execute('INSERT INTO Employees (id, name, email) VALUES (?, ?, ?)', (id, name, email))
+            employee_id = c.lastrowid
+            save_entitlements(c, _form_entitlements(employee_id))
+            refresh_ledger(c, [employee_id])
+            bump_data_version(c)
             conn.commit()
         except sqlite3.IntegrityError:
-            conn.close()
             return "工号已存在", 400
-        conn.close()
         return redirect(url_for('index'))
     return render_template('add_employee.html', year_pairs=list(zip(YEAR_COLUMNS, YEAR_COLUMNS_CN)))
 
 # Edit employee
 @app.route('/edit_employee/<int:employee_id>', methods=['GET', 'POST'])
 def edit_employee(employee_id):
-    conn = sqlite3.connect('leave_management.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT * FROM Employees WHERE id=?', (employee_id,))
-    employee = c.fetchone()
+    employee = fetch_employee(c, employee_id)
     if employee is None:
-        conn.close()
         return "员工不存在", 404
     if request.method == 'POST':
         name = request.form['name']
         email = request.form['email']
-        year_values = [float(request.form.get(col, 0) or 0) for col in YEAR_COLUMNS]
-        set_clause = 'name=?, email=?, ' + ', '.join(f'{col}=?' for col in YEAR_COLUMNS) + ' WHERE id=?'
-        c.execute(f'UPDATE Employees SET {set_clause}', (name, email, *year_values, employee_id))
+        c.execute('UPDATE Employees SET name=?, email=? WHERE id=?', (name, email, employee_id))
+        save_entitlements(c, _form_entitlements(employee_id))
+        refresh_ledger(c, [employee_id])
+        bump_data_version(c)
         conn.commit()
-        conn.close()
         return redirect(url_for('index'))
-    conn.close()
-    employee = normalize_employee_row(employee)
     return render_template('edit_employee.html', employee=employee, year_pairs=list(zip(YEAR_COLUMNS, YEAR_COLUMNS_CN)))
 
 # Delete employee
 @app.route('/delete_employee/<int:employee_id>', methods=['GET', 'POST'])
 def delete_employee(employee_id):
-    conn = sqlite3.connect('leave_management.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT * FROM Employees WHERE id=?', (employee_id,))
     employee = c.fetchone()
     if employee is None:
-        conn.close()
         return "员工不存在", 404
     if request.method == 'POST':
-        c.execute('DELETE FROM LeaveRecords WHERE employee_id=?', (employee_id,))
-        c.execute('DELETE FROM Employees WHERE id=?', (employee_id,))
+        delete_employee_rows(c, employee_id)
+        bump_data_version(c)
         conn.commit()
-        conn.close()
         return redirect(url_for('index'))
-    conn.close()
     return render_template('confirm_delete.html', employee=employee)
 
+
+def delete_employee_rows(c, employee_id):
+    """删除员工及其休假记录、年度天数、结转明细、台账与全文索引"""
+    c.execute('DELETE FROM LeaveRecords WHERE employee_id=?', (employee_id,))
+    c.execute('DELETE FROM Employees WHERE id=?', (employee_id,))
+    c.execute('DELETE FROM EmployeeEntitlements WHERE employee_id=?', (employee_id,))
+    c.execute('DELETE FROM Rollovers WHERE employee_id=?', (employee_id,))
+    c.execute('DELETE FROM LeaveSummary WHERE employee_id=?', (employee_id,))
+    c.execute('DELETE FROM LeaveBalances WHERE employee_id=?', (employee_id,))
+    sync_search_index(c)
+
+
+# 休假记录各列由 起止日期 + 上午/下午 + 天数 等字段生成，表单与 JSON API 共用
+LEAVE_COLUMNS = ('leave_info', 'start_date', 'end_date', 'days', 'application_time', 'leave_type', 'remark',
+                 'start_on', 'start_period', 'end_on', 'end_period')
+# 未写明上午/下午时按整天处理：上午开始、下午结束
+LEAVE_FIELDS = (('start_date', ''), ('start_period', '上午'), ('end_date', ''), ('end_period', '下午'),
+                ('days', ''), ('application_time', ''), ('leave_type', '年假'), ('remark', ''))
+
+
+class LeaveDateError(ValueError):
+    """起止日期不合理，消息直接展示给用户"""
+
+
+class DuplicateLeaveError(ValueError):
+    """同一员工已有相同申请时间和休假信息的记录"""
+
+
+def leave_values(start_date, start_period, end_date, end_period, days, application_time, leave_type, remark,
+                 calendar=None):
+    """返回 LeaveRecords 各列的值（顺序同 LEAVE_COLUMNS）
+
+    传入工作日历且起止日期齐全时，天数按工作日重新计算，忽略填写的天数。
+    """
+    # Store start_date and end_date with period
+    start_date_full = f"{start_date} {start_period}" if start_date and start_period else start_date
+    end_date_full = f"{end_date} {end_period}" if end_date and end_period else end_date
+    dates = leave_dates(start_date_full, end_date_full)
+    start_on, start_pm, end_on, end_am = dates[0], dates[1] == '下午', dates[2], dates[3] == '上午'
+    if start_on and end_on:
+        if end_on < start_on or (end_on == start_on and start_pm and end_am):
+            raise LeaveDateError('结束时间不能早于开始时间')
+        if calendar is not None:
+            days = float(calendar.leave_days(start_on, start_pm, end_on, end_am))
+    days_text = days if isinstance(days, str) else ('' if days is None else f'{days:g}')
+    # Construct leave_info with '天' unit
+    if start_date and end_date and days_text:
+        leave_info = f"{start_date.replace('-', '/')}{' ' + start_period if start_period else ''}~{end_date.replace('-', '/')}{' ' + end_period if end_period else ''}, {days_text}天 {leave_type}"
+    else:
+        leave_info = ''
+    # Convert days
+    try:
+        days = float(days_text) if days_text else None
+    except ValueError:
+        days = None
+    return (leave_info, start_date_full or None, end_date_full or None, days, application_time or None,
+            leave_type, remark or None, *dates)
+
+
+def _form_leave_values():
+    return leave_values(*(request.form.get(name, default) for name, default in LEAVE_FIELDS),
+                        calendar=workday_calendar(get_db().cursor()))
+
+
+def _leave_key(c, leave_id):
+    return c.execute('SELECT application_time, leave_info FROM LeaveRecords WHERE id=?', (leave_id,)).fetchone()
+
+
+def _check_duplicate_leave(c, leave_id):
+    """写入后检查记录的去重键是否与同一员工的其他记录相同；相同则抛出 DuplicateLeaveError，由调用方回滚"""
+    c.execute('''SELECT 1 FROM LeaveRecords n JOIN LeaveRecords o
+                     ON o.employee_id = n.employee_id AND o.application_time = n.application_time
+                    AND o.leave_info = n.leave_info AND o.id <> n.id
+                 WHERE n.id = ? AND n.leave_info <> '' LIMIT 1''', (leave_id,))
+    if c.fetchone():
+        raise DuplicateLeaveError('相同申请时间的休假记录已存在')
+
+
+def insert_leave(c, employee_id, values):
+    c.execute(f'''INSERT INTO LeaveRecords (employee_id, {', '.join(LEAVE_COLUMNS)})
+                 VALUES (?, {', '.join(['?'] * len(LEAVE_COLUMNS))})''', (employee_id, *values))
+    leave_id = c.lastrowid
+    _check_duplicate_leave(c, leave_id)
+    return leave_id
+
+
+def insert_new_leaves(c, rows):
+    """批量写入 (employee_id, *LEAVE_COLUMNS) 行，跳过 (员工, 申请时间, 休假信息) 已存在的行，返回写入条数
+
+    逐行判断 NOT EXISTS，同一批次中靠后的重复行也能看到前面刚写入的行；休假信息为空的行不去重。
+    """
+    applied, info = (f'?{LEAVE_COLUMNS.index(col) + 2}' for col in ('application_time', 'leave_info'))
+    c.executemany(f'''INSERT INTO LeaveRecords (employee_id, {', '.join(LEAVE_COLUMNS)})
+                      SELECT {', '.join(f'?{i}' for i in range(1, len(LEAVE_COLUMNS) + 2))}
+                      WHERE NOT EXISTS (SELECT 1 FROM LeaveRecords
+                                        WHERE employee_id = ?1 AND application_time = {applied}
+                                          AND leave_info = {info} AND {info} <> '')''', rows)
+    return max(c.rowcount, 0)
+
+
+def update_leave(c, leave_id, changes):
+    """changes 为 {列: 值}；只在申请时间或休假信息变化时检查重复，已有的重复记录仍可修改其他字段"""
+    key = _leave_key(c, leave_id)
+    c.execute(f"UPDATE LeaveRecords SET {', '.join(f'{col}=?' for col in changes)} WHERE id=?",
+              (*changes.values(), leave_id))
+    if _leave_key(c, leave_id) != key:
+        _check_duplicate_leave(c, leave_id)
+
+
 # Add leave record
 @app.route('/employee/<int:employee_id>/add_leave', methods=['GET', 'POST'])
 def add_leave(employee_id):
     if request.method == 'POST':
-        start_date = request.form.get('start_date', '')
-        start_period = request.form.get('start_period', '上午')
-        end_date = request.form.get('end_date', '')
-        end_period = request.form.get('end_period', '上午')
-        days = request.form.get('days', '')
-        application_time = request.form.get('application_time', '')
-        leave_type = request.form.get('leave_type', '年假')
-        remark = request.form.get('remark', '')
-        # Construct leave_info with '天' unit
-        if start_date and end_date and days:
-            leave_info = f"{start_date.replace('-', '/')}{' ' + start_period if start_period else ''}~{end_date.replace('-', '/')}{' ' + end_period if end_period else ''}, {days}天 {leave_type}"
-        else:
-            leave_info = ''
-        # Convert days
-        try:
-            days = float(days) if days else None
-        except ValueError:
-            days = None
-        # Store start_date and end_date with period
-        start_date_full = f"{start_date} {start_period}" if start_date and start_period else start_date
-        end_date_full = f"{end_date} {end_period}" if end_date and end_period else end_date
-        conn = sqlite3.connect('leave_management.db')
+        conn = get_db()
         c = conn.cursor()
-        c.execute('INSERT INTO LeaveRecords (employee_id, leave_info, start_date, end_date, days, application_time, leave_type, remark) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                  (employee_id, leave_info, start_date_full or None, end_date_full or None, days, application_time or None, leave_type, remark or None))
+        try:
+            insert_leave(c, employee_id, _form_leave_values())
+        except LeaveDateError as e:
+            return str(e), 400
+        except DuplicateLeaveError as e:
+            conn.rollback()
+            return str(e), 400
+        refresh_ledger(c, [employee_id])
+        bump_data_version(c)
         conn.commit()
-        conn.close()
         return redirect(url_for('employee', employee_id=employee_id))
     return render_template('add_leave.html', employee_id=employee_id)
 
 # Edit leave record
 @app.route('/employee/<int:employee_id>/edit_leave/<int:leave_id>', methods=['GET', 'POST'])
 def edit_leave(employee_id, leave_id):
-    conn = sqlite3.connect('leave_management.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT * FROM LeaveRecords WHERE id=? AND employee_id=?', (leave_id, employee_id))
     leave = c.fetchone()
     if not leave:
-        conn.close()
         return "休假记录不存在", 404
     if request.method == 'POST':
-        start_date = request.form.get('start_date', '')
-        start_period = request.form.get('start_period', '上午')
-        end_date = request.form.get('end_date', '')
-        end_period = request.form.get('end_period', '上午')
-        days = request.form.get('days', '')
-        application_time = request.form.get('application_time', '')
-        leave_type = request.form.get('leave_type', '年假')
-        remark = request.form.get('remark', '')
-        # Construct leave_info with '天' unit
-        if start_date and end_date and days:
-            leave_info = f"{start_date.replace('-', '/')}{' ' + start_period if start_period else ''}~{end_date.replace('-', '/')}{' ' + end_period if end_period else ''}, {days}天 {leave_type}"
-        else:
-            leave_info = ''
-        # Convert days
         try:
-            days = float(days) if days else None
-        except ValueError:
-            days = None
-        # Store start_date and end_date with period
-        start_date_full = f"{start_date} {start_period}" if start_date and start_period else start_date
-        end_date_full = f"{end_date} {end_period}" if end_date and end_period else end_date
-        c.execute('''UPDATE LeaveRecords SET
-                     leave_info=?, start_date=?, end_date=?, days=?,
-                     application_time=?, leave_type=?, remark=?
-                     WHERE id=? AND employee_id=?''',
-                  (leave_info, start_date_full or None, end_date_full or None, days,
-                   application_time or None, leave_type, remark or None, leave_id, employee_id))
+            update_leave(c, leave_id, dict(zip(LEAVE_COLUMNS, _form_leave_values())))
+        except LeaveDateError as e:
+            return str(e), 400
+        except DuplicateLeaveError as e:
+            conn.rollback()
+            return str(e), 400
+        refresh_ledger(c, [employee_id])
+        bump_data_version(c)
         conn.commit()
-        conn.close()
         return redirect(url_for('employee', employee_id=employee_id))
     # Parse existing data for form
     start_date, start_period = (leave[3].split(' ') + ['上午'])[:2] if leave[3] else ('', '上午')
-    end_date, end_period = (leave[4].split(' ') + ['上午'])[:2] if leave[4] else ('', '上午')
-    conn.close()
+    end_date, end_period = (leave[4].split(' ') + ['下午'])[:2] if leave[4] else ('', '下午')
     return render_template('edit_leave.html', employee_id=employee_id, leave=leave,
                          start_date=start_date, start_period=start_period,
                          end_date=end_date, end_period=end_period)
@@ -297,253 +1356,992 @@ def edit_leave(employee_id, leave_id):
 # Delete leave record
 @app.route('/employee/<int:employee_id>/delete_leave/<int:leave_id>', methods=['GET', 'POST'])
 def delete_leave(employee_id, leave_id):
-    conn = sqlite3.connect('leave_management.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT * FROM LeaveRecords WHERE id=? AND employee_id=?', (leave_id, employee_id))
     leave = c.fetchone()
     if not leave:
-        conn.close()
         return "休假记录不存在", 404
     if request.method == 'POST':
         c.execute('DELETE FROM LeaveRecords WHERE id=? AND employee_id=?', (leave_id, employee_id))
+        refresh_ledger(c, [employee_id])
+        bump_data_version(c)
         conn.commit()
-        conn.close()
         return redirect(url_for('employee', employee_id=employee_id))
-    conn.close()
     return render_template('confirm_delete_leave.html', employee_id=employee_id, leave=leave)
 
 # Import employee data（兼容历史 Excel：仅有 2023–2025 列时，2026/2027 自动填 0）
+# 按工号 upsert：已存在的员工更新姓名、邮箱及文件中出现的年度列，不存在的新增；
+# 有问题的行单独拒绝并给出原因，不影响其他行
+EMPLOYEE_IMPORT_REQUIRED = ['id', 'name', 'email'] + [f'total_days_{y}' for y in (2023, 2024, 2025)]
+
+
+def _validate_employee_rows(df, year_cols):
+    """整列校验，返回 (可写入的行 DataFrame, 被拒绝的行 {行索引: 原因})"""
+    reasons = pd.Series('', index=df.index, dtype=object)
+
+    def reject(mask, reason):
+        reasons[mask & (reasons == '')] = reason
+
+    ids = pd.to_numeric(df['id'], errors='coerce')
+    reject(df['id'].isna(), '工号为空')
+    reject(ids.isna() | (ids != ids.round()), '工号不是整数')
+    out = pd.DataFrame({'id': ids})
+    for col, label in (('name', '姓名'), ('email', '邮箱')):
+        text = _clean_text(df[col])
+        reject(text.isna(), f'{label}为空')
+        out[col] = text
+    for col in year_cols:
+        values = pd.to_numeric(df[col], errors='coerce')
+        label = f'{col[len("total_days_"):]}年度总天数'
+        if col in EMPLOYEE_IMPORT_REQUIRED:
+            reject(df[col].isna(), f'{label}为空')
+        reject(df[col].notna() & values.isna(), f'{label}不是数字')
+        out[col] = values.fillna(0)
+    reject(ids.notna() & ids.duplicated(), '文件内工号重复')
+    ok = reasons == ''
+    out = out[ok].astype({'id': 'int64'})
+    return out, reasons[~ok].to_dict()
+
+
+def upsert_employees(c, df):
+    """按工号批量 upsert 员工，返回逐行结果 [(Excel 行号, 工号, 姓名, 结果, 原因)] 及各结果计数
+
+    调用方负责提交事务。
+    """
+    year_cols = [col for col in YEAR_COLUMNS if col in df.columns]
+    with metrics.section('pandas'):
+        valid, rejected = _validate_employee_rows(df, year_cols)
+    c.execute('SELECT id FROM Employees WHERE id IN (SELECT value FROM json_each(?))',
+              (json.dumps(valid['id'].tolist()),))
+    existing = {row[0] for row in c.fetchall()}
+    c.executemany('''INSERT INTO Employees (id, name, email) VALUES (?, ?, ?)
+                     ON CONFLICT(id) DO UPDATE SET name=excluded.name, email=excluded.email''',
+                  valid[['id', 'name', 'email']].astype(object).itertuples(index=False, name=None))
+    # 宽表的年度列转成 (工号, 年度, 天数) 长表写入；文件中没有的年度不改动
+    if year_cols:
+        long = valid.melt(id_vars='id', value_vars=year_cols, var_name='year', value_name='days')
+        long['year'] = long['year'].str[-4:].astype('int64')
+        save_entitlements(c, long[['id', 'year', 'days']].astype(object).itertuples(index=False, name=None))
+    refresh_ledger(c, valid['id'].tolist())
+    bump_data_version(c)
+    status = pd.Series('拒绝', index=df.index, dtype=object)
+    status[valid.index] = valid['id'].isin(existing).map({True: '更新', False: '新增'})
+    reason = pd.Series(rejected, index=df.index, dtype=object).fillna('')
+    shown = df[['id', 'name']].astype(object).where(df[['id', 'name']].notna(), '')
+    # Excel 行号：第 1 行为表头
+    row_numbers = df['excel_row'] if 'excel_row' in df.columns else df.index + 2
+    report = list(zip(row_numbers, shown['id'], shown['name'], status, reason))
+    counts = {s: int((status == s).sum()) for s in ('新增', '更新', '拒绝')}
+    return report, counts
+
+
+class ImportFileError(ValueError):
+    """导入文件本身不可用（无法读取、缺少必要列等），消息直接展示给用户"""
+
+
+def _import_columns(header, mapping):
+    """表头中可识别的列 {表头列名: 内部列名}；同一内部列出现多次（如中英文列名并存）时取第一个"""
+    columns = {}
+    for name in header:
+        if name in mapping and mapping[name] not in columns.values():
+            columns[name] = mapping[name]
+    return columns
+
+
+def _import_sheets(path, mapping, required):
+    """只读各工作表表头，返回 (含全部必要列的工作表 {工作表名: {表头列名: 内部列名}}, None)
+
+    没有任何工作表可导入时返回 (None, 第一个工作表缺少的列)，此时文件的数据行尚未读取。
+    """
+    sheets, first_missing = {}, None
+    for sheet, header in excel.sheet_headers(path).items():
+        columns = _import_columns(header, mapping)
+        missing = [col for col in required if col not in columns.values()]
+        if not missing:
+            sheets[sheet] = columns
+        elif first_missing is None:
+            first_missing = missing
+    return (sheets, None) if sheets else (None, first_missing or required)
+
+
+def load_employee_import(file):
+    mapping = {'工号': 'id', '姓名': 'name', '邮箱': 'email', **dict(zip(YEAR_COLUMNS_CN, YEAR_COLUMNS))}
+    mapping.update({col: col for col in ['id', 'name', 'email'] + YEAR_COLUMNS})
+    try:
+        with excel.local_path(file) as path:
+            sheets, missing_cols = _import_sheets(path, mapping, EMPLOYEE_IMPORT_REQUIRED)
+            if sheets is None:
+                raise ImportFileError(f"Excel 文件缺少必要列: {', '.join(missing_cols)}")
+            with metrics.section('read_excel'):
+                return excel.read_sheets(path, sheets)
+    except ImportFileError:
+        raise
+    except Exception as e:
+        raise ImportFileError(f"读取 Excel 文件失败: {str(e)}")
+
+
+@_in_app_context
+def _import_employees_job(job, path):
+    job.update(0.1, '读取 Excel')
+    df = load_employee_import(path)
+    job.update(0.5, f'写入 {len(df)} 行')
+    conn = get_db()
+    report, counts = upsert_employees(conn.cursor(), df)
+    conn.commit()
+    return {'counts': counts, 'rejected': [r for r in report if r[3] == '拒绝']}
+
+
 @app.route('/import_employees', methods=['POST'])
 def import_employees():
     file = request.files['file']
     if not file or not file.filename.endswith('.xlsx'):
         return "请上传有效的 .xlsx 文件", 400
+    if request.args.get('async'):
+        return _submit_upload_job('import_employees', file, _import_employees_job)
     try:
-        df = pd.read_excel(file, engine='openpyxl')
-    except Exception as e:
-        return f"读取 Excel 文件失败: {str(e)}", 400
-    column_mapping = {'工号': 'id', '姓名': 'name', '邮箱': 'email'}
-    column_mapping.update({cn: col for cn, col in zip(YEAR_COLUMNS_CN, YEAR_COLUMNS)})
-    df = df.rename(columns=column_mapping)
-    base_required = ['id', 'name', 'email'] + [f'total_days_{y}' for y in (2023, 2024, 2025)]
-    if not all(col in df.columns for col in base_required):
-        missing_cols = [col for col in base_required if col not in df.columns]
-        return f"Excel 文件缺少必要列: {', '.join(missing_cols)}", 400
-    for col in base_required:
-        if df[col].isna().any():
-            return f"列 '{col}' 包含空值", 400
-    for col in YEAR_COLUMNS:
-        if col not in df.columns:
-            df[col] = 0
-    use_columns = ['id', 'name', 'email'] + YEAR_COLUMNS
-    conn = sqlite3.connect('leave_management.db')
-    try:
-        df[use_columns].to_sql('Employees', conn, if_exists='append', index=False)
-    except sqlite3.IntegrityError:
-        conn.close()
-        return "工号重复", 400
+        df = load_employee_import(file)
+    except ImportFileError as e:
+        return str(e), 400
+    conn = get_db()
+    report, counts = upsert_employees(conn.cursor(), df)
     conn.commit()
-    conn.close()
-    return redirect(url_for('index'))
+    return render_template('import_report.html', report=report, counts=counts)
+
+# 导出：按块从游标读取，xlsx 以 openpyxl 只写模式写入溢出到磁盘的临时文件，
+# csv / ndjson 以生成器流式返回，内存占用与数据量无关
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+EXPORT_FORMATS = ('xlsx', 'csv', 'ndjson')
+
+
+def _iter_rows(c, sql, params=()):
+    """立即执行查询（c.description 随即可用），返回按块 fetchmany 的行迭代器"""
+    c.execute(sql, params)
+
+    def chunks():
+        while True:
+            rows = c.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            yield from rows
+    return chunks()
+
+
+def _export_response(header, rows, filename):
+    """按 ?format= 返回 xlsx（默认）/ csv / ndjson 下载"""
+    fmt = request.args.get('format', 'xlsx')
+    if fmt == 'xlsx':
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+        write_xlsx(output, header, rows)
+        if output.tell() <= EXPORT_SPOOL_MAX_SIZE:
+            # 仍在内存中：转成 BytesIO 让响应带上 Content-Length，可进入页面缓存
+            output.seek(0)
+            output = BytesIO(output.read())
+        output.seek(0)
+        return send_file(output, download_name=f'{filename}.xlsx', as_attachment=True,
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # 流式响应在视图返回、应用上下文拆除（release_db）之后才逐块读取行：把连接移出 g，
+    # 读完（或响应关闭）时再归还连接池，避免仍有打开的游标时被其他请求借走
+    conn = g.pop('db')
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            _db_pool().release(conn)
+
+    def body():
+        try:
+            yield from (iter_csv(header, rows) if fmt == 'csv' else iter_ndjson(header, rows))
+        finally:
+            release()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(body()), mimetype=f'{mimetype}; charset=utf-8',
+                        headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'})
+    # 未开始读取就关闭的响应（如客户端断开）不会执行生成器的 finally
+    response.call_on_close(release)
+    return response
+
+
+def write_export(output, fmt, header, rows):
+    """把导出内容写入已打开的二进制文件（后台任务使用）"""
+    if fmt == 'xlsx':
+        write_xlsx(output, header, rows)
+        return
+    for chunk in (iter_csv(header, rows) if fmt == 'csv' else iter_ndjson(header, rows)):
+        output.write(chunk)
+
+
+def write_xlsx(output, header, rows):
+    with metrics.section('write_xlsx'):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+        wb.save(output)
+
+
+def iter_csv(header, rows):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')  # BOM，Excel 打开中文不乱码
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def iter_ndjson(header, rows):
+    for row in rows:
+        yield (json.dumps(dict(zip(header, row)), ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _leave_export_header():
+    return ['工号', '姓名', '邮箱'] + YEAR_COLUMNS_CN + ['结转作废天数', '2023年至今已休年假信息', '总年休假天数', '剩余年休假天数', '邮件申请时间', '假期类型', '本次休假天数', '备注']
+
+
+def _leave_export_rows(c, employee_id=None):
+    """按导出列顺序逐行产出休假记录；总天数与剩余天数读取台账，无休假记录的员工剩余天数即总天数
+
+    总天数 = 各年度天数合计 − 结转作废天数，作废天数单列，便于与各年度列对账。
+    """
+    if employee_id is not None:
+        where, ent_filter, params = 'WHERE e.id = ?', 'employee_id = ?', (employee_id, employee_id)
+    else:
+        where, ent_filter, params = '', '1', ()
+    return _iter_rows(c, f'''
+        WITH {_entitlement_cte(ent_filter)}
+        SELECT e.id, e.name, e.email, {_entitlement_columns_sql()}, COALESCE(ro.expired, 0),
+               lr.leave_info, COALESCE(lb.total_days, 0), COALESCE(lr.remaining_after, lb.total_days, 0),
+               lr.application_time, lr.leave_type, lr.days, lr.remark
+        FROM Employees e
+        LEFT JOIN ent ON ent.employee_id = e.id
+        LEFT JOIN (SELECT employee_id, SUM(expired) AS expired FROM Rollovers GROUP BY employee_id) ro
+               ON ro.employee_id = e.id
+        LEFT JOIN LeaveBalances lb ON lb.employee_id = e.id
+        LEFT JOIN LeaveRecords lr ON e.id = lr.employee_id
+        {where}
+        ORDER BY e.id, lr.application_time ASC, lr.id ASC
+    ''', params)
+
+
+def _export_source(kind, employee_id=None):
+    """返回 (表头, 行迭代器, 预计行数, 文件名)"""
+    c = get_db().cursor()
+    if kind == 'export_employees':
+        total = c.execute('SELECT COUNT(*) FROM Employees').fetchone()[0]
+        rows = _iter_rows(c, f'''WITH {_entitlement_cte()}
+            SELECT e.id, e.name, e.email, {_entitlement_columns_sql()}
+            FROM Employees e LEFT JOIN ent ON ent.employee_id = e.id
+            ORDER BY e.id''')
+        return ['id', 'name', 'email'] + YEAR_COLUMNS, rows, total, 'employees'
+    where, params = ('WHERE e.id = ?', (employee_id,)) if employee_id is not None else ('', ())
+    total = c.execute(f'SELECT COUNT(*) FROM Employees e LEFT JOIN LeaveRecords lr ON e.id = lr.employee_id {where}',
+                      params).fetchone()[0]
+    filename = f'leave_records_{employee_id}' if employee_id is not None else 'all_leave_records'
+    return _leave_export_header(), _leave_export_rows(c, employee_id), total, filename
+
+
+@_in_app_context
+def _export_job(job, kind, fmt, employee_id=None):
+    header, rows, total, filename = _export_source(kind, employee_id)
+
+    def counted(rows):
+        for i, row in enumerate(rows, 1):
+            if i % EXPORT_CHUNK_SIZE == 0:
+                job.update(i / max(total, 1), f'已写入 {i} / {total} 行')
+            yield row
+    path = jobs.path_for(job, f'{filename}.{fmt}')
+    with open(path, 'wb') as output:
+        write_export(output, fmt, header, counted(rows))
+    job.file_path, job.download_name = path, f'{filename}.{fmt}'
+    return {'rows': total}
+
+
+def _export(kind, employee_id=None):
+    fmt = request.args.get('format', 'xlsx')
+    if fmt not in EXPORT_FORMATS:
+        return f"不支持的导出格式: {fmt}", 400
+    if request.args.get('async'):
+        return _job_accepted(jobs.submit(kind, _export_job, kind, fmt, employee_id))
+    header, rows, _, filename = _export_source(kind, employee_id)
+    return _export_response(header, rows, filename)
+
 
 # Export employee data（导出含全部年度列，便于来年再导入）
 @app.route('/export_employees')
+@cached_view
 def export_employees():
-    conn = sqlite3.connect('leave_management.db')
-    df = pd.read_sql_query('SELECT * FROM Employees', conn)
-    conn.close()
-    output = BytesIO()
-    df.to_excel(output, index=False, engine='openpyxl')
-    output.seek(0)
-    return send_file(output, download_name='employees.xlsx', as_attachment=True)
+    return _export('export_employees')
 
 # Export leave records for a single employee
 @app.route('/employee/<int:employee_id>/export_leaves')
+@cached_view
 def export_leaves(employee_id):
-    conn = sqlite3.connect('leave_management.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM Employees WHERE id=?', (employee_id,))
-    employee = c.fetchone()
-    if not employee:
-        conn.close()
+    c = get_db().cursor()
+    c.execute('SELECT 1 FROM Employees WHERE id=?', (employee_id,))
+    if not c.fetchone():
         return "员工不存在", 404
-    year_cols_sql = ', '.join(f'e.{col}' for col in YEAR_COLUMNS)
-    df = pd.read_sql_query(f'''
-        SELECT e.id, e.name, e.email, {year_cols_sql},
-               lr.leave_info, lr.application_time, lr.leave_type, lr.remark, lr.days
-        FROM Employees e
-        LEFT JOIN LeaveRecords lr ON e.id = lr.employee_id
-        WHERE e.id = ?
-        ORDER BY lr.application_time ASC
-    ''', conn, params=(employee_id,))
-    conn.close()
-    df['总年休假天数'] = df[YEAR_COLUMNS].sum(axis=1)
-    # Calculate remaining days
-    remaining_days = df['总年休假天数'].iloc[0] if not df.empty else 0
-    df['剩余年休假天数'] = 0.0
-    for i in range(len(df)):
-        days = df['days'].iloc[i] if pd.notna(df['days'].iloc[i]) else 0
-        if df['leave_type'].iloc[i] == '年假' and days > 0:
-            remaining_days -= days
-        df.loc[i, '剩余年休假天数'] = remaining_days
-    rename_map = {'id': '工号', 'name': '姓名', 'email': '邮箱',
-                  'leave_info': '2023年至今已休年假信息', 'application_time': '邮件申请时间',
-                  'leave_type': '假期类型', 'remark': '备注', 'days': '本次休假天数'}
-    rename_map.update({col: cn for col, cn in zip(YEAR_COLUMNS, YEAR_COLUMNS_CN)})
-    df = df.rename(columns=rename_map)
-    export_cols = ['工号', '姓名', '邮箱'] + YEAR_COLUMNS_CN + ['2023年至今已休年假信息', '总年休假天数', '剩余年休假天数', '邮件申请时间', '假期类型', '本次休假天数', '备注']
-    output = BytesIO()
-    df[export_cols].to_excel(output, index=False, engine='openpyxl')
-    output.seek(0)
-    return send_file(output, download_name=f'leave_records_{employee_id}.xlsx', as_attachment=True)
+    return _export('export_leaves', employee_id)
 
 # Export all leave records
 @app.route('/export_all_leaves')
+@cached_view
 def export_all_leaves():
-    conn = sqlite3.connect('leave_management.db')
-    year_cols_sql = ', '.join(f'e.{col}' for col in YEAR_COLUMNS)
-    df = pd.read_sql_query(f'''
-        SELECT e.id, e.name, e.email, {year_cols_sql},
-               lr.leave_info, lr.application_time, lr.leave_type, lr.remark, lr.days
-        FROM Employees e
-        LEFT JOIN LeaveRecords lr ON e.id = lr.employee_id
-        ORDER BY e.id, lr.application_time ASC
-    ''', conn)
-    conn.close()
-    df['总年休假天数'] = df[YEAR_COLUMNS].sum(axis=1)
-    # Calculate remaining days per employee
-    df['剩余年休假天数'] = 0.0
-    for emp_id in df['id'].unique():
-        emp_mask = df['id'] == emp_id
-        remaining_days = df.loc[emp_mask, '总年休假天数'].iloc[0] if emp_mask.any() else 0
-        for i in df[emp_mask].index:
-            days = df.loc[i, 'days'] if pd.notna(df.loc[i, 'days']) else 0
-            if df.loc[i, 'leave_type'] == '年假' and days > 0:
-                remaining_days -= days
-            df.loc[i, '剩余年休假天数'] = remaining_days
-    rename_map = {'id': '工号', 'name': '姓名', 'email': '邮箱',
-                  'leave_info': '2023年至今已休年假信息', 'application_time': '邮件申请时间',
-                  'leave_type': '假期类型', 'remark': '备注', 'days': '本次休假天数'}
-    rename_map.update({col: cn for col, cn in zip(YEAR_COLUMNS, YEAR_COLUMNS_CN)})
-    df = df.rename(columns=rename_map)
-    export_cols = ['工号', '姓名', '邮箱'] + YEAR_COLUMNS_CN + ['2023年至今已休年假信息', '总年休假天数', '剩余年休假天数', '邮件申请时间', '假期类型', '本次休假天数', '备注']
-    output = BytesIO()
-    df[export_cols].to_excel(output, index=False, engine='openpyxl')
-    output.seek(0)
-    return send_file(output, download_name='all_leave_records.xlsx', as_attachment=True)
+    return _export('export_all_leaves')
+
+
+_DAYS_AFTER_COMMA_RE = re.compile(r'[,，]\s*(\d+(?:\.\d+)?)\s*天')
+_DAYS_ANYWHERE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*天')
+
+
+def _replace_days(leave_info, days):
+    """把「已休年假信息」中逗号后的天数换成 days，没有天数的原样返回"""
+    match = _DAYS_AFTER_COMMA_RE.search(leave_info or '')
+    if match is None:
+        return leave_info
+    return f'{leave_info[:match.start(1)]}{days:g}{leave_info[match.end(1):]}'
 
 
 def _parse_days_from_leave_info(leave_info):
-    """从「已休年假信息」中解析本次天数，如 ', 2.5天 年假' -> 2.5"""
-    if not leave_info or pd.isna(leave_info):
-        return None
-    s = str(leave_info).strip()
-    m = re.search(r'[,，]\s*(\d+(?:\.\d+)?)\s*天', s) or re.search(r'(\d+(?:\.\d+)?)\s*天', s)
-    return float(m.group(1)) if m else None
+    """从「已休年假信息」中解析本次天数，如 ', 2.5天 年假' -> 2.5（对整列向量化处理）"""
+    days = leave_info.str.extract(_DAYS_AFTER_COMMA_RE, expand=False)
+    days = days.fillna(leave_info.str.extract(_DAYS_ANYWHERE_RE, expand=False))
+    return pd.to_numeric(days, errors='coerce')
 
 
 def _parse_start_end_from_leave_info(leave_info):
-    """从「已休年假信息」解析起止日期，如 '2024/1/1 上午~2024/1/3 下午' -> (start_full, end_full)"""
-    if not leave_info or pd.isna(leave_info):
-        return None, None
-    s = str(leave_info).strip()
-    part = s.split(',')[0].strip() if ',' in s else s
-    if '~' not in part:
-        return None, None
-    a, b = part.split('~', 1)
-    a, b = a.strip(), b.strip()
-    def norm(x):
-        x = x.replace('/', '-')
-        if re.match(r'\d{4}-\d{1,2}-\d{1,2}', x):
-            return x
-        return x
-    return norm(a), norm(b)
+    """从「已休年假信息」解析起止日期，如 '2024/1/1 上午~2024/1/3 下午' -> (start_full, end_full) 两列"""
+    part = leave_info.str.split(',', n=1).str[0].str.strip()
+    halves = part.str.split('~', n=1)
+    start = halves.str[0].astype('string').str.strip().str.replace('/', '-', regex=False)
+    end = halves.str[1].astype('string').str.strip().str.replace('/', '-', regex=False)
+    no_range = end.isna()
+    return start.mask(no_range), end
+
+
+# 日期文本兼容 2024-1-3 / 2024/01/03 / 2024.1.3，可带「上午」「下午」
+_LEAVE_DATE_RE = r'^\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\s*(上午|下午)?'
+
+
+def _split_leave_date(col, default_period):
+    parts = col.astype('string').str.extract(_LEAVE_DATE_RE)
+    iso = parts[0] + '-' + parts[1].str.zfill(2) + '-' + parts[2].str.zfill(2)
+    iso = iso.where(pd.to_datetime(iso, format='%Y-%m-%d', errors='coerce').notna())
+    period = parts[3].fillna(default_period).where(iso.notna())
+    return iso, period
+
+
+def leave_date_columns(start, end):
+    """整列把起止日期文本规范成 start_on / start_period / end_on / end_period（无法解析为 None）
+
+    未写明上午/下午时按整天处理：开始记为上午，结束记为下午。
+    """
+    start_on, start_period = _split_leave_date(start, '上午')
+    end_on, end_period = _split_leave_date(end, '下午')
+    out = pd.DataFrame({'start_on': start_on, 'start_period': start_period,
+                        'end_on': end_on, 'end_period': end_period}).astype(object)
+    return out.where(out.notna(), None)
+
+
+def leave_dates(start, end):
+    """单条记录版本：返回 (start_on, start_period, end_on, end_period)"""
+    return next(leave_date_columns(pd.Series([start]), pd.Series([end])).itertuples(index=False, name=None))
+
+
+def _clean_text(col):
+    """整列去首尾空白，空值与空串统一为 None"""
+    col = col.astype(object)
+    present = col.notna()
+    col[present] = col[present].astype(str).str.strip()
+    return col.where(present & (col != ''), None)
 
 
 # 导入休假记录（与「导出所有休假记录」同格式的 xlsx，兼容无「本次休假天数」列的历史导出）
-@app.route('/import_leave_records', methods=['POST'])
-def import_leave_records():
-    file = request.files.get('file')
-    if not file or not file.filename.lower().endswith('.xlsx'):
-        return "请上传有效的 .xlsx 文件（与「导出所有休假记录」格式一致）", 400
-    try:
-        df = pd.read_excel(file, engine='openpyxl')
-    except Exception as e:
-        return f"读取 Excel 失败: {str(e)}", 400
+# 多个工作表（如按年度分表的历史文件）中含必要列的都会导入
+def load_leave_import(file):
     # 列名兼容中英文
     col_cn = {
         '工号': 'id', '姓名': 'name', '邮箱': 'email',
         '2023年至今已休年假信息': 'leave_info', '邮件申请时间': 'application_time',
         '假期类型': 'leave_type', '备注': 'remark', '本次休假天数': 'days'
     }
-    df = df.rename(columns=col_cn)
-    if 'leave_info' not in df.columns:
-        return "Excel 缺少列「2023年至今已休年假信息」", 400
-    if 'id' not in df.columns:
-        return "Excel 缺少列「工号」", 400
-    # 只处理有休假内容的行
-    df = df[df['leave_info'].notna() & (df['leave_info'].astype(str).str.strip() != '')]
+    mapping = {**col_cn, **{col: col for col in col_cn.values()}}
+    try:
+        with excel.local_path(file) as path:
+            sheets, missing_cols = _import_sheets(path, mapping, ['leave_info', 'id'])
+            if sheets is None:
+                if 'leave_info' in missing_cols:
+                    raise ImportFileError("Excel 缺少列「2023年至今已休年假信息」")
+                raise ImportFileError("Excel 缺少列「工号」")
+            # 只处理有休假内容的行，逐块读取时即丢弃其余行
+            with metrics.section('read_excel'):
+                df = excel.read_sheets(path, sheets, functools.partial(excel.drop_blank, 'leave_info'))
+    except ImportFileError:
+        raise
+    except Exception as e:
+        raise ImportFileError(f"读取 Excel 失败: {str(e)}")
     if df.empty:
-        return "文件中没有有效的休假记录行", 400
-    conn = sqlite3.connect('leave_management.db')
-    c = conn.cursor()
+        raise ImportFileError("文件中没有有效的休假记录行")
+    return df
+
+
+def _normalize_leave_import(df):
+    """整列规范化导入的休假记录，返回 (工号列, 待写入的行)"""
+    ids = pd.to_numeric(df['id'], errors='coerce')
+    leave_info = _clean_text(df['leave_info'])
+    days = pd.to_numeric(df['days'], errors='coerce') if 'days' in df.columns else pd.Series(float('nan'), index=df.index)
+    days = days.fillna(_parse_days_from_leave_info(leave_info.astype('string')))
+    start_full, end_full = _parse_start_end_from_leave_info(leave_info.astype('string'))
+    leave_type = _clean_text(df['leave_type']) if 'leave_type' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    rows = pd.DataFrame({
+        'employee_id': ids,
+        'leave_info': leave_info,
+        'start_date': start_full.astype(object),
+        'end_date': end_full.astype(object),
+        'days': days.astype(object),
+        'application_time': _clean_text(df['application_time']) if 'application_time' in df.columns else None,
+        'leave_type': leave_type.fillna('年假'),
+        'remark': _clean_text(df['remark']) if 'remark' in df.columns else None,
+    })
+    rows = rows.astype(object).where(rows.notna(), None)
+    rows = pd.concat([rows, leave_date_columns(rows['start_date'], rows['end_date'])], axis=1)
+    return ids, rows
+
+
+def import_leave_frame(c, df):
+    """批量写入休假记录，返回 (成功, 工号无效跳过, 重复跳过) 条数；调用方负责提交事务"""
+    # 整列规范化后一次性批量写入，insert_new_leaves 负责去重
+    with metrics.section('pandas'):
+        ids, rows = _normalize_leave_import(df)
     c.execute('SELECT id FROM Employees')
     valid_ids = {row[0] for row in c.fetchall()}
-    inserted, skipped_no_emp, skipped_dup = 0, 0, 0
-    for _, row in df.iterrows():
-        eid = row.get('id')
-        if pd.isna(eid):
-            skipped_no_emp += 1
-            continue
-        try:
-            eid = int(eid)
-        except (TypeError, ValueError):
-            skipped_no_emp += 1
-            continue
-        if eid not in valid_ids:
-            skipped_no_emp += 1
-            continue
-        leave_info = row.get('leave_info')
-        leave_info = None if pd.isna(leave_info) else str(leave_info).strip() or None
-        application_time = row.get('application_time')
-        application_time = None if pd.isna(application_time) else str(application_time).strip() or None
-        leave_type = row.get('leave_type')
-        leave_type = '年假' if pd.isna(leave_type) or str(leave_type).strip() == '' else str(leave_type).strip()
-        remark = row.get('remark')
-        remark = None if pd.isna(remark) else str(remark).strip() or None
-        days = row.get('days')
-        if pd.isna(days) or (isinstance(days, str) and days.strip() == ''):
-            days = _parse_days_from_leave_info(leave_info)
-        else:
-            try:
-                days = float(days)
-            except (TypeError, ValueError):
-                days = _parse_days_from_leave_info(leave_info)
-        start_full, end_full = _parse_start_end_from_leave_info(leave_info)
-        # 防重复：同一员工、同一申请时间、同一 leave_info 视为同一条
-        c.execute('SELECT 1 FROM LeaveRecords WHERE employee_id=? AND application_time=? AND leave_info=? LIMIT 1',
-                  (eid, application_time, leave_info))
-        if c.fetchone():
-            skipped_dup += 1
-            continue
-        c.execute('''INSERT INTO LeaveRecords (employee_id, leave_info, start_date, end_date, days, application_time, leave_type, remark)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (eid, leave_info, start_full, end_full, days, application_time, leave_type, remark))
-        inserted += 1
-    conn.commit()
-    conn.close()
+    ids = ids.dropna().astype('int64')
+    rows = rows.loc[ids.index].assign(employee_id=ids)
+    rows = rows[rows['employee_id'].isin(valid_ids)]
+    skipped_no_emp = len(df) - len(rows)
+    inserted = insert_new_leaves(c, rows[['employee_id', *LEAVE_COLUMNS]].itertuples(index=False, name=None))
+    skipped_dup = len(rows) - inserted
+    if inserted:
+        refresh_ledger(c, rows['employee_id'].unique().tolist())
+        bump_data_version(c)
+    return inserted, skipped_no_emp, skipped_dup
+
+
+def _leave_import_message(inserted, skipped_no_emp, skipped_dup):
     msg = f"休假记录导入完成：成功 {inserted} 条"
     if skipped_no_emp:
         msg += f"，工号不存在或无效跳过 {skipped_no_emp} 条"
     if skipped_dup:
         msg += f"，重复跳过 {skipped_dup} 条"
-    flash(msg)
+    return msg
+
+
+@_in_app_context
+def _import_leave_records_job(job, path):
+    job.update(0.1, '读取 Excel')
+    df = load_leave_import(path)
+    job.update(0.5, f'写入 {len(df)} 行')
+    conn = get_db()
+    counts = import_leave_frame(conn.cursor(), df)
+    conn.commit()
+    job.update(message=_leave_import_message(*counts))
+    return dict(zip(('inserted', 'skipped_no_employee', 'skipped_duplicate'), counts))
+
+
+@app.route('/import_leave_records', methods=['POST'])
+def import_leave_records():
+    file = request.files.get('file')
+    if not file or not file.filename.lower().endswith('.xlsx'):
+        return "请上传有效的 .xlsx 文件（与「导出所有休假记录」格式一致）", 400
+    if request.args.get('async'):
+        return _submit_upload_job('import_leave_records', file, _import_leave_records_job)
+    try:
+        df = load_leave_import(file)
+    except ImportFileError as e:
+        return str(e), 400
+    conn = get_db()
+    counts = import_leave_frame(conn.cursor(), df)
+    conn.commit()
+    flash(_leave_import_message(*counts))
     return redirect(url_for('index'))
 
 
+# 后台任务：导入 / 导出加 ?async=1 时提交到进程内线程池，立即返回任务号，
+# 客户端轮询 /jobs/<job_id> 获取进度，导出完成后从 /jobs/<job_id>/download 下载
+def _job_accepted(job):
+    body = job.to_dict()
+    body['status_url'] = url_for('job_status', job_id=job.id)
+    return jsonify(body), 202, {'Location': body['status_url']}
+
+
+def _submit_upload_job(kind, file, func):
+    """上传的文件在请求结束后即不可读，先落盘到任务目录再提交"""
+    job = jobs.create(kind)
+    path = jobs.path_for(job, 'upload.xlsx')
+    file.save(path)
+    jobs.start(job, func, path)
+    return _job_accepted(job)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    body = job.to_dict()
+    body['status_url'] = url_for('job_status', job_id=job.id)
+    if job.file_path:
+        body['download_url'] = url_for('job_download', job_id=job.id)
+    return jsonify(body)
+
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = jobs.get(job_id)
+    if job is None or job.status != 'done' or not job.file_path:
+        return "导出文件不存在或已过期", 404
+    return send_file(job.file_path, download_name=job.download_name, as_attachment=True)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的请求指标（需 ELEAVE_METRICS=1）"""
+    if not METRICS_ENABLED:
+        return "未启用性能指标（设置环境变量 ELEAVE_METRICS=1）", 404
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# JSON API：/api/... 与页面读写同一份数据，供脚本与 HR 看板调用
+# 列表按 id 做游标分页（?cursor=上一页返回的 next_cursor&limit=），?fields=a,b 只返回所需字段
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_BATCH_MAX = 1000
+
+
+class ApiError(Exception):
+    """API 请求错误，以 {"error": 消息} 及对应状态码返回"""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    body = {'error': str(e)}
+    if e.details:
+        body['details'] = e.details
+    return jsonify(body), e.status
+
+
+# 字段名 -> SQL 表达式；entitlements（各年度总天数）按页单独查询
+API_EMPLOYEE_FIELDS = {
+    'id': 'e.id', 'name': 'e.name', 'email': 'e.email',
+    'total_days': 'COALESCE(lb.total_days, 0)',
+    'used_days': 'COALESCE(lb.used_days, 0)',
+    'remaining_days': 'COALESCE(lb.total_days, 0) - COALESCE(lb.used_days, 0)',
+    'entitlements': None,
+}
+API_EMPLOYEE_FROM = 'Employees e LEFT JOIN LeaveBalances lb ON lb.employee_id = e.id'
+API_BALANCE_FIELDS = ['id', 'total_days', 'used_days', 'remaining_days', 'entitlements']
+API_LEAVE_FIELDS = {name: f'lr.{name}' for name in (
+    'id', 'employee_id', 'leave_info', 'start_on', 'start_period', 'end_on', 'end_period',
+    'days', 'application_time', 'leave_type', 'remark', 'remaining_after')}
+API_LEAVE_FROM = 'LeaveRecords lr'
+
+
+def _api_fields(allowed):
+    requested = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise ApiError(f"未知字段: {', '.join(unknown)}")
+    return requested or list(allowed)
+
+
+def _api_select(c, fields, field_sql, from_sql, where='1', params=(), limit=None):
+    """只查询所选字段；每行额外带 _id 供分页使用"""
+    id_sql = field_sql['id']
+    cols = ''.join(f', {field_sql[f]} AS {f}' for f in fields if field_sql[f])
+    sql = f'SELECT {id_sql} AS _id{cols} FROM {from_sql} WHERE {where} ORDER BY {id_sql}'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params = (*params, limit)
+    c.execute(sql, params)
+    names = [d[0] for d in c.description]
+    rows = [dict(zip(names, row)) for row in c.fetchall()]
+    if 'entitlements' in fields and rows:
+        c.execute('''SELECT employee_id, year, days FROM EmployeeEntitlements
+                     WHERE employee_id IN (SELECT value FROM json_each(?)) ORDER BY employee_id, year''',
+                  (json.dumps([row['_id'] for row in rows]),))
+        entitlements = {}
+        for employee_id, year, days in c.fetchall():
+            entitlements.setdefault(employee_id, {})[str(year)] = days
+        for row in rows:
+            row['entitlements'] = entitlements.get(row['_id'], {})
+    return rows
+
+
+def _api_list(c, allowed, from_sql, where=(), params=()):
+    fields = _api_fields(allowed)
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    where = [f"{allowed['id']} > ?", *where]
+    rows = _api_select(c, fields, allowed, from_sql, ' AND '.join(where), (cursor, *params), limit + 1)
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({'data': [{f: row[f] for f in fields} for row in rows],
+                    'next_cursor': rows[-1]['_id'] if has_next else None})
+
+
+def _api_get(c, allowed, from_sql, item_id, fields=None, missing='记录不存在'):
+    fields = fields or _api_fields(allowed)
+    rows = _api_select(c, fields, allowed, from_sql, f"{allowed['id']} = ?", (item_id,))
+    if not rows:
+        raise ApiError(missing, 404)
+    return {f: rows[0][f] for f in fields}
+
+
+def _api_json():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiError('请求体须为 JSON 对象')
+    return data
+
+
+def _api_text(data, key, required=False):
+    value = data.get(key)
+    if value is None:
+        if required:
+            raise ApiError(f'缺少字段: {key}')
+        return None
+    if not isinstance(value, str) or not value.strip():
+        raise ApiError(f'{key} 须为非空字符串')
+    return value.strip()
+
+
+def _api_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _api_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _api_entitlements(data):
+    """{"2024": 10, ...} -> [(年度, 天数)]"""
+    value = data.get('entitlements', {})
+    if not isinstance(value, dict):
+        raise ApiError('entitlements 须为 {年度: 天数} 对象')
+    rows = []
+    for year, days in value.items():
+        # 只接受页面与导出所显示的年度，否则总天数会计入看不到的年度
+        if not re.fullmatch(r'\d{4}', str(year)) or int(year) not in YEARS:
+            raise ApiError(f'无效年度: {year}（须在 {YEARS[0]}-{YEARS[-1]} 之间）')
+        if not _api_number(days):
+            raise ApiError(f'{year}年度总天数不是数字')
+        rows.append((int(year), float(days)))
+    return rows
+
+
+def _api_leave_values(data, current=None):
+    """校验休假字段并生成各列的值；修改时未提供的字段沿用 current"""
+    fields = dict(current or LEAVE_FIELDS)
+    fields.update({name: data[name] for name, _ in LEAVE_FIELDS if name in data})
+    for name in ('start_date', 'end_date'):
+        if fields[name] in (None, ''):
+            fields[name] = ''
+            continue
+        try:
+            fields[name] = date.fromisoformat(fields[name]).isoformat()
+        except (TypeError, ValueError):
+            raise ApiError(f'{name} 须为 YYYY-MM-DD 格式的日期')
+    for name in ('start_period', 'end_period'):
+        if fields[name] not in ('上午', '下午'):
+            raise ApiError(f'{name} 须为 上午 或 下午')
+    if fields['days'] in (None, ''):
+        fields['days'] = None
+    elif not _api_number(fields['days']) or fields['days'] < 0:
+        raise ApiError('days 须为非负数')
+    for name in ('application_time', 'leave_type', 'remark'):
+        if fields[name] is not None and not isinstance(fields[name], str):
+            raise ApiError(f'{name} 须为字符串')
+    fields['leave_type'] = fields['leave_type'] or '年假'
+    try:
+        return leave_values(*(fields[name] for name, _ in LEAVE_FIELDS), calendar=workday_calendar(get_db().cursor()))
+    except LeaveDateError as e:
+        raise ApiError(str(e))
+
+
+# 休假信息、起止日期与天数由这些字段生成；PATCH 只改申请时间 / 备注时不重新生成，
+# 导入的记录休假信息可能无法解析，重新生成会清空原文或改变天数
+API_LEAVE_DERIVED_FIELDS = ('start_date', 'start_period', 'end_date', 'end_period', 'days', 'leave_type')
+# PATCH 不能修改的字段：记录号、所属员工与由起止日期生成的列。与当前值相同时允许出现，
+# 便于把 GET 的结果改几个字段后原样提交；要换员工请删除后在新员工下新增
+API_LEAVE_READONLY_FIELDS = ('id', 'employee_id', 'leave_info', 'start_on', 'end_on', 'remaining_after')
+
+
+def _api_plain_leave_values(data):
+    """PATCH 中不影响生成列的字段 {列名: 值}"""
+    changes = {}
+    for name in ('application_time', 'remark'):
+        if name in data:
+            if data[name] is not None and not isinstance(data[name], str):
+                raise ApiError(f'{name} 须为字符串')
+            changes[name] = data[name] or None
+    return changes
+
+
+def _api_require_employee(c, employee_id):
+    if c.execute('SELECT 1 FROM Employees WHERE id=?', (employee_id,)).fetchone() is None:
+        raise ApiError(f'员工不存在: {employee_id}', 404)
+    return employee_id
+
+
+@app.route('/api/employees')
+def api_list_employees():
+    return _api_list(get_db().cursor(), API_EMPLOYEE_FIELDS, API_EMPLOYEE_FROM)
+
+
+@app.route('/api/employees/<int:employee_id>')
+def api_get_employee(employee_id):
+    return jsonify(_api_get(get_db().cursor(), API_EMPLOYEE_FIELDS, API_EMPLOYEE_FROM, employee_id,
+                            missing='员工不存在'))
+
+
+@app.route('/api/employees/<int:employee_id>/balance')
+def api_employee_balance(employee_id):
+    return jsonify(_api_get(get_db().cursor(), API_EMPLOYEE_FIELDS, API_EMPLOYEE_FROM, employee_id,
+                            fields=API_BALANCE_FIELDS, missing='员工不存在'))
+
+
+@app.route('/api/employees', methods=['POST'])
+def api_create_employee():
+    data = _api_json()
+    employee_id = data.get('id')
+    if employee_id is not None and not _api_int(employee_id):
+        raise ApiError('id 须为整数')
+    name, email = _api_text(data, 'name', required=True), _api_text(data, 'email', required=True)
+    entitlements = _api_entitlements(data)
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute('INSERT INTO Employees (id, name, email) VALUES (?, ?, ?)', (employee_id, name, email))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        raise ApiError('工号已存在', 409)
+    employee_id = c.lastrowid
+    save_entitlements(c, [(employee_id, year, days) for year, days in entitlements])
+    refresh_ledger(c, [employee_id])
+    bump_data_version(c)
+    conn.commit()
+    body = _api_get(c, API_EMPLOYEE_FIELDS, API_EMPLOYEE_FROM, employee_id, fields=list(API_EMPLOYEE_FIELDS))
+    return jsonify(body), 201, {'Location': url_for('api_get_employee', employee_id=employee_id)}
+
+
+@app.route('/api/employees/<int:employee_id>', methods=['PATCH'])
+def api_update_employee(employee_id):
+    """只修改请求中出现的字段；entitlements 中未出现的年度保持不变"""
+    data = _api_json()
+    name, email = _api_text(data, 'name'), _api_text(data, 'email')
+    entitlements = _api_entitlements(data)
+    conn = get_db()
+    c = conn.cursor()
+    _api_require_employee(c, employee_id)
+    c.execute('UPDATE Employees SET name=COALESCE(?, name), email=COALESCE(?, email) WHERE id=?',
+              (name, email, employee_id))
+    save_entitlements(c, [(employee_id, year, days) for year, days in entitlements])
+    refresh_ledger(c, [employee_id])
+    bump_data_version(c)
+    conn.commit()
+    return jsonify(_api_get(c, API_EMPLOYEE_FIELDS, API_EMPLOYEE_FROM, employee_id, fields=list(API_EMPLOYEE_FIELDS)))
+
+
+@app.route('/api/employees/<int:employee_id>', methods=['DELETE'])
+def api_delete_employee(employee_id):
+    conn = get_db()
+    c = conn.cursor()
+    _api_require_employee(c, employee_id)
+    delete_employee_rows(c, employee_id)
+    bump_data_version(c)
+    conn.commit()
+    return '', 204
+
+
+@app.route('/api/leaves')
+def api_list_leaves():
+    """可按 employee_id / leave_type / date_from / date_to（与休假区间有交集）筛选"""
+    where, params = [], []
+    employee_id = request.args.get('employee_id', type=int)
+    if employee_id is not None:
+        where.append('lr.employee_id = ?')
+        params.append(employee_id)
+    if request.args.get('leave_type'):
+        where.append('lr.leave_type = ?')
+        params.append(request.args['leave_type'])
+    if request.args.get('date_from'):
+        where.append('lr.end_on >= ?')
+        params.append(request.args['date_from'])
+    if request.args.get('date_to'):
+        where.append('lr.start_on <= ?')
+        params.append(request.args['date_to'])
+    return _api_list(get_db().cursor(), API_LEAVE_FIELDS, API_LEAVE_FROM, where, params)
+
+
+@app.route('/api/search')
+def api_search():
+    """全文检索休假记录（参数 q，可选 leave_type），按相关度排序（匹配过多时最新在前，ranked 为 false），limit / offset 分页"""
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    conn = get_db()
+    c = conn.cursor()
+    _sync_before_search(conn, c)
+    result = search_leaves(c, request.args.get('q', ''), request.args.get('leave_type'), limit, offset)
+    if result is None:
+        raise ApiError('q 须包含可检索的文字')
+    total, rows, ranked = result
+    fields = ['id', 'employee_id', 'employee_name', 'leave_info', 'application_time', 'leave_type',
+              'remark', 'days', 'remaining_after']
+    return jsonify({'data': [dict(zip(fields, row)) for row in rows], 'total': total, 'ranked': ranked,
+                    'next_offset': offset + limit if offset + limit < total else None})
+
+
+@app.route('/api/leaves/<int:leave_id>')
+def api_get_leave(leave_id):
+    return jsonify(_api_get(get_db().cursor(), API_LEAVE_FIELDS, API_LEAVE_FROM, leave_id,
+                            missing='休假记录不存在'))
+
+
+@app.route('/api/calendar')
+def api_calendar():
+    """逐日休假人数，参数同 /calendar"""
+    args = _calendar_args()
+    if isinstance(args, str):
+        raise ApiError(args)
+    start, end, leave_type, workdays_only = args
+    days = leave_calendar(get_db().cursor(), start, end, leave_type, workdays_only)
+    return jsonify({'date_from': start.isoformat(), 'date_to': end.isoformat(),
+                    'days': days.to_dict(orient='records')})
+
+
+def _api_new_leave(c, item):
+    """校验一条新增请求，返回 (工号, 各列的值)"""
+    if not isinstance(item, dict):
+        raise ApiError('须为 JSON 对象')
+    if not _api_int(item.get('employee_id')):
+        raise ApiError('employee_id 须为整数')
+    values = _api_leave_values(item)
+    return _api_require_employee(c, item['employee_id']), values
+
+
+@app.route('/api/leaves', methods=['POST'])
+def api_create_leave():
+    data = _api_json()
+    conn = get_db()
+    c = conn.cursor()
+    employee_id, values = _api_new_leave(c, data)
+    try:
+        leave_id = insert_leave(c, employee_id, values)
+    except DuplicateLeaveError as e:
+        conn.rollback()
+        raise ApiError(str(e), 409)
+    refresh_ledger(c, [employee_id])
+    bump_data_version(c)
+    conn.commit()
+    body = _api_get(c, API_LEAVE_FIELDS, API_LEAVE_FROM, leave_id, fields=list(API_LEAVE_FIELDS))
+    return jsonify(body), 201, {'Location': url_for('api_get_leave', leave_id=leave_id)}
+
+
+@app.route('/api/leaves/batch', methods=['POST'])
+def api_create_leaves():
+    """一次请求新增多条休假记录，同一事务写入并只重算一次台账；任何一条无效则整批不写入"""
+    items = _api_json().get('leaves')
+    if not isinstance(items, list) or not items:
+        raise ApiError('leaves 须为非空数组')
+    if len(items) > API_BATCH_MAX:
+        raise ApiError(f'单次最多 {API_BATCH_MAX} 条')
+    conn = get_db()
+    c = conn.cursor()
+    rows, errors = [], []
+    for i, item in enumerate(items):
+        try:
+            rows.append(_api_new_leave(c, item))
+        except ApiError as e:
+            errors.append({'index': i, 'error': str(e)})
+    if errors:
+        raise ApiError('部分记录无效，未写入任何记录', details=errors)
+    leave_ids = []
+    for i, (employee_id, values) in enumerate(rows):
+        try:
+            leave_ids.append(insert_leave(c, employee_id, values))
+        except DuplicateLeaveError as e:
+            conn.rollback()
+            raise ApiError(f'{e}，未写入任何记录', 409, details=[{'index': i, 'error': str(e)}])
+    refresh_ledger(c, sorted({employee_id for employee_id, _ in rows}))
+    bump_data_version(c)
+    conn.commit()
+    return jsonify({'created': len(leave_ids), 'ids': leave_ids}), 201
+
+
+@app.route('/api/leaves/<int:leave_id>', methods=['PATCH'])
+def api_update_leave(leave_id):
+    data = _api_json()
+    conn = get_db()
+    c = conn.cursor()
+    c.execute('''SELECT employee_id, start_on, start_period, end_on, end_period, days, application_time, leave_type, remark
+                 FROM LeaveRecords WHERE id=?''', (leave_id,))
+    row = c.fetchone()
+    if row is None:
+        raise ApiError('休假记录不存在', 404)
+    employee_id = row[0]
+    stored = c.execute(f"SELECT {', '.join(API_LEAVE_READONLY_FIELDS)} FROM LeaveRecords WHERE id=?", (leave_id,)).fetchone()
+    readonly = [name for name, value in zip(API_LEAVE_READONLY_FIELDS, stored) if name in data and data[name] != value]
+    if readonly:
+        raise ApiError(f"不能修改字段: {', '.join(readonly)}")
+    current = dict(zip([name for name, _ in LEAVE_FIELDS], row[1:]))
+    current['start_period'] = current['start_period'] or '上午'
+    current['end_period'] = current['end_period'] or '下午'
+    if any(name in data for name in API_LEAVE_DERIVED_FIELDS):
+        values, changes = _api_leave_values(data, current), None
+    else:
+        values, changes = None, _api_plain_leave_values(data)
+    try:
+        if values is not None:
+            update_leave(c, leave_id, dict(zip(LEAVE_COLUMNS, values)))
+        elif changes:
+            update_leave(c, leave_id, changes)
+    except DuplicateLeaveError as e:
+        conn.rollback()
+        raise ApiError(str(e), 409)
+    refresh_ledger(c, [employee_id])
+    bump_data_version(c)
+    conn.commit()
+    return jsonify(_api_get(c, API_LEAVE_FIELDS, API_LEAVE_FROM, leave_id, fields=list(API_LEAVE_FIELDS)))
+
+
+@app.route('/api/leaves/<int:leave_id>', methods=['DELETE'])
+def api_delete_leave(leave_id):
+    conn = get_db()
+    c = conn.cursor()
+    row = c.execute('SELECT employee_id FROM LeaveRecords WHERE id=?', (leave_id,)).fetchone()
+    if row is None:
+        raise ApiError('休假记录不存在', 404)
+    c.execute('DELETE FROM LeaveRecords WHERE id=?', (leave_id,))
+    refresh_ledger(c, [row[0]])
+    bump_data_version(c)
+    conn.commit()
+    return '', 204
+
+
 if __name__ == '__main__':
-    if not os.path.exists('leave_management.db'):
+    with app.app_context():
         init_db()
-    else:
-        migrate_db()
+    _schema_checked = (app.config['DATABASE'], datetime.now().year)
     app.run(host='0.0.0.0', port=8000)
@@ -0,0 +1,80 @@
+"""剩余年假计算基准：逐行循环（旧版导出实现） vs 向量化 compute_remaining_days
+
+    python benchmarks/bench_remaining_days.py --employees 10000 --records 50
+
+旧版循环对每名员工都要在整张表上做一次掩码，耗时随员工数近似平方增长，
+全量数据下跑不完，因此只在 --legacy-employees 名员工的子集上对比两种实现。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import compute_remaining_days  # noqa: E402
+
+
+def make_frame(employees, records, seed=0):
+    """按员工、申请时间排好序的合成休假记录"""
+    rng = np.random.default_rng(seed)
+    n = employees * records
+    df = pd.DataFrame({
+        'employee_id': np.repeat(np.arange(1, employees + 1), records),
+        'total_days': np.repeat(rng.integers(5, 16, employees) * 4, records).astype(float),
+        'leave_type': np.where(rng.random(n) < 0.7, '年假', '其他假'),
+        'days': rng.integers(1, 7, n) / 2,
+    })
+    df.loc[rng.random(n) < 0.02, 'days'] = np.nan
+    return df
+
+
+def legacy_remaining_days(df):
+    """旧版 export_all_leaves() 中的逐行实现"""
+    out = pd.Series(0.0, index=df.index)
+    for emp_id in df['employee_id'].unique():
+        emp_mask = df['employee_id'] == emp_id
+        remaining_days = df.loc[emp_mask, 'total_days'].iloc[0]
+        for i in df[emp_mask].index:
+            days = df.loc[i, 'days'] if pd.notna(df.loc[i, 'days']) else 0
+            if df.loc[i, 'leave_type'] == '年假' and days > 0:
+                remaining_days -= days
+            out[i] = remaining_days
+    return out
+
+
+def timed(func, *args, repeat=1):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=10000)
+    parser.add_argument('--records', type=int, default=50, help='每名员工的休假记录数')
+    parser.add_argument('--legacy-employees', type=int, default=200, help='旧版循环参与对比的员工数')
+    args = parser.parse_args()
+
+    sample = make_frame(args.legacy_employees, args.records)
+    legacy_t, legacy = timed(legacy_remaining_days, sample)
+    vector_t, vector = timed(compute_remaining_days, sample, repeat=5)
+    assert np.allclose(legacy.to_numpy(), vector.to_numpy()), '两种实现结果不一致'
+    print(f'{args.legacy_employees} 名员工 × {args.records} 条 ({len(sample)} 行)')
+    print(f'  逐行循环   {legacy_t * 1000:10.1f} ms')
+    print(f'  向量化     {vector_t * 1000:10.1f} ms   加速 {legacy_t / vector_t:.0f}x')
+
+    full = make_frame(args.employees, args.records)
+    full_t, _ = timed(compute_remaining_days, full, repeat=3)
+    print(f'{args.employees} 名员工 × {args.records} 条 ({len(full)} 行)')
+    print(f'  向量化     {full_t * 1000:10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""路由基准：在合成数据库上通过 Flask 测试客户端逐个请求页面、导出与导入
+
+    python benchmarks/bench_routes.py --employees 2000 --records 30 --repeat 5 --output results.json
+    python benchmarks/bench_routes.py --db /tmp/bench.db --baseline results.json
+
+每条路由报告延迟分位数（p50 / p90 / p99 / 最大）、单次请求的 Python 峰值内存（tracemalloc）
+与执行的 SQL 语句数（按游标的 execute / executemany 计，与 ELEAVE_METRICS 的 sql_count 口径相同，
+FTS5 影子表等 SQLite 内部语句不计入）。结果写入 JSON 文件，--baseline 指定上一版本的结果文件时逐项列出变化。
+默认每次请求前清空页面缓存，测的是实际查询与渲染；--warm-cache 则保留缓存。
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic  # noqa: E402
+import app as eleave  # noqa: E402
+import metrics  # noqa: E402
+
+# 连接池改用计时连接（metrics.TracedConnection），由应用自己的请求钩子开始 / 结束每个请求的 trace；
+# 只需在连接池创建前设置
+eleave.TRACING = True
+_traces = [None]
+
+
+@eleave.app.before_request
+def _remember_trace():
+    # 注册在应用的 start_request_trace 之后，取到的是本次请求的 trace；流式响应读完后才结束计数
+    _traces[0] = metrics.current_trace()
+
+
+def import_files(rows):
+    """取库中前 rows 行员工 / 休假记录，按导出格式生成两个导入用 xlsx"""
+    files = {}
+    with eleave.app.app_context():
+        for kind in ('export_employees', 'export_all_leaves'):
+            header, source, _, _ = eleave._export_source(kind)
+            output = BytesIO()
+            eleave.write_xlsx(output, header, itertools.islice(source, rows))
+            files[kind] = output.getvalue()
+    return files['export_employees'], files['export_all_leaves']
+
+
+def routes(employees, import_rows):
+    """(名称, 发起请求的函数)；员工页每次随机取一名员工"""
+    rng = np.random.default_rng(0)
+    year = eleave.YEARS[-1]
+    employee_xlsx, leave_xlsx = import_files(import_rows)
+
+    def get(url):
+        return lambda client: client.get(url() if callable(url) else url)
+
+    def upload(url, data):
+        return lambda client: client.post(url, data={'file': (BytesIO(data), 'bench.xlsx')},
+                                          content_type='multipart/form-data')
+
+    return [
+        ('index', get('/')),
+        ('employee', get(lambda: f'/employee/{rng.integers(1, employees + 1)}')),
+        ('all_leaves', get('/all_leaves')),
+        ('all_leaves_filtered', get(f'/all_leaves?leave_type=年假&date_from={year}-03-01&date_to={year}-03-31')),
+        ('who_is_off', get('/who_is_off')),
+        ('calendar_year', get(f'/calendar?date_from={year}-01-01&date_to={year}-12-31')),
+        ('search', get(lambda: f'/search?q=员工{rng.integers(1, employees + 1)}')),
+        ('search_common_term', get('/api/search?q=年假')),
+        ('export_employees_xlsx', get('/export_employees')),
+        ('export_employees_csv', get('/export_employees?format=csv')),
+        ('export_leaves_xlsx', get(lambda: f'/employee/{rng.integers(1, employees + 1)}/export_leaves')),
+        ('export_all_leaves_xlsx', get('/export_all_leaves')),
+        ('export_all_leaves_csv', get('/export_all_leaves?format=csv')),
+        ('export_all_leaves_ndjson', get('/export_all_leaves?format=ndjson')),
+        ('export_calendar_xlsx', get(f'/calendar/export?date_from={year}-01-01&date_to={year}-12-31')),
+        ('import_employees', upload('/import_employees', employee_xlsx)),
+        ('import_leave_records', upload('/import_leave_records', leave_xlsx)),
+    ]
+
+
+def request_once(client, send, warm_cache):
+    if not warm_cache:
+        eleave.view_cache.clear()
+    _traces[0] = None
+    start = time.perf_counter()
+    response = send(client)
+    response.get_data()  # 流式导出在读取响应体时才真正执行
+    elapsed = time.perf_counter() - start
+    response.close()
+    return elapsed, _traces[0].sql_count, response.status_code
+
+
+def run(client, send, repeat, warm_cache):
+    timings, queries, status = [], 0, None
+    for _ in range(repeat):
+        elapsed, queries, status = request_once(client, send, warm_cache)
+        timings.append(elapsed * 1000)
+    # 峰值内存单独测一次：tracemalloc 本身会拖慢请求，不计入延迟
+    tracemalloc.start()
+    request_once(client, send, warm_cache)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+    return {'n': repeat, 'p50_ms': round(p50, 2), 'p90_ms': round(p90, 2), 'p99_ms': round(p99, 2),
+            'max_ms': round(max(timings), 2), 'peak_kib': round(peak / 1024, 1),
+            'queries': queries, 'status': status}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    base = (baseline or {}).get('routes', {})
+    print(f"{'路由':<26}{'p50':>10}{'p90':>10}{'p99':>10}{'峰值 KiB':>12}{'SQL':>7}  {'状态'}")
+    for name, r in results['routes'].items():
+        line = (f"{name:<26}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+                f"{r['peak_kib']:>12.0f}{r['queries']:>7}  {r['status']}")
+        if name in base and base[name]['p50_ms']:
+            change = (r['p50_ms'] - base[name]['p50_ms']) / base[name]['p50_ms'] * 100
+            line += f"   p50 {change:+.0f}% (基线 {base[name]['p50_ms']:.1f} ms, SQL {base[name]['queries']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='使用已有数据库（复制后再测，原文件不被导入改动）；不指定则生成合成库')
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--records', type=int, default=30, help='每名员工的休假记录数')
+    parser.add_argument('--repeat', type=int, default=5, help='每条路由的请求次数')
+    parser.add_argument('--import-rows', type=int, default=2000, help='导入文件的行数')
+    parser.add_argument('--only', help='只测名称包含该字符串的路由')
+    parser.add_argument('--warm-cache', action='store_true', help='保留页面缓存（默认每次请求前清空）')
+    parser.add_argument('--output', help='结果 JSON 文件')
+    parser.add_argument('--baseline', help='用于对比的上一版本结果 JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='eleave-bench-')
+    path = os.path.join(workdir, 'leave_management.db')
+    try:
+        if args.db:
+            shutil.copyfile(args.db, path)
+            eleave.app.config['DATABASE'] = path
+        else:
+            start = time.perf_counter()
+            n = synthetic.make_db(path, args.employees, args.years, args.records)
+            print(f'合成数据库：{args.employees} 名员工，{n} 条休假记录（{time.perf_counter() - start:.1f}s）')
+        with eleave.app.app_context():
+            c = eleave.get_db().cursor()
+            employees = c.execute('SELECT COUNT(*) FROM Employees').fetchone()[0]
+            records = c.execute('SELECT COUNT(*) FROM LeaveRecords').fetchone()[0]
+        client = eleave.app.test_client()
+        client.get('/')  # 启动检查（迁移）不计入结果
+        results = {
+            'meta': {
+                'revision': git_revision(), 'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(), 'employees': employees, 'leave_records': records,
+                'repeat': args.repeat, 'warm_cache': args.warm_cache,
+            },
+            'routes': {},
+        }
+        for name, send in routes(employees, args.import_rows):
+            if args.only and args.only not in name:
+                continue
+            results['routes'][name] = run(client, send, args.repeat, args.warm_cache)
+    finally:
+        eleave.db.get_pool(path).close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
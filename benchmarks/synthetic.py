@@ -0,0 +1,96 @@
+"""生成合成的 leave_management.db，供路由基准与手工压测使用
+
+    python benchmarks/synthetic.py /tmp/bench.db --employees 2000 --years 3 --records 30
+
+表结构由 app 的迁移创建，年度天数、休假记录（含上午/下午半天与按工作日计算的天数）
+用 numpy 整列生成后批量写入，最后重建台账，生成的库与真实使用后的库形态一致。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as eleave  # noqa: E402
+from workdays import WorkdayCalendar  # noqa: E402
+
+
+def leave_frame(employees, years, records, seed=0):
+    """每名员工 records 条休假记录，起始日均匀分布在最近 years 个年度内"""
+    rng = np.random.default_rng(seed)
+    n = employees * records
+    first = np.datetime64(f'{eleave.YEARS[-1] - years + 1}-01-01')
+    span = (np.datetime64(f'{eleave.YEARS[-1]}-12-27') - first).astype(np.int64)
+    start = first + rng.integers(0, span, n).astype('timedelta64[D]')
+    end = start + rng.choice([0, 0, 0, 1, 1, 2, 4], n).astype('timedelta64[D]')
+    start_pm = rng.random(n) < 0.15
+    end_am = (rng.random(n) < 0.15) & ~((end == start) & start_pm)
+    days = WorkdayCalendar().leave_days(start, start_pm, end, end_am)
+    df = pd.DataFrame({
+        'employee_id': np.repeat(np.arange(1, employees + 1), records),
+        'start_on': np.datetime_as_string(start),
+        'start_period': np.where(start_pm, '下午', '上午'),
+        'end_on': np.datetime_as_string(end),
+        'end_period': np.where(end_am, '上午', '下午'),
+        'days': days,
+        'application_time': np.datetime_as_string(start - rng.integers(1, 30, n).astype('timedelta64[D]')),
+        'leave_type': np.where(rng.random(n) < 0.8, '年假', '其他假'),
+        'remark': np.where(rng.random(n) < 0.1, '合成数据', None),
+    })
+    df['start_date'] = df['start_on'] + ' ' + df['start_period']
+    df['end_date'] = df['end_on'] + ' ' + df['end_period']
+    df['leave_info'] = (df['start_on'].str.replace('-', '/') + ' ' + df['start_period'] + '~'
+                        + df['end_on'].str.replace('-', '/') + ' ' + df['end_period'] + ', '
+                        + df['days'].map('{:g}'.format) + '天 ' + df['leave_type'])
+    return df
+
+
+def make_db(path, employees=1000, years=3, records=30, seed=0):
+    """在 path 新建合成数据库（已存在则覆盖），返回休假记录数"""
+    eleave.app.config['DATABASE'] = path
+    eleave._db_pool().close_all()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rng = np.random.default_rng(seed)
+    with eleave.app.app_context():
+        eleave.init_db()
+        conn = eleave.get_db()
+        c = conn.cursor()
+        ids = np.arange(1, employees + 1)
+        c.executemany('INSERT INTO Employees (id, name, email) VALUES (?, ?, ?)',
+                      ((int(i), f'员工{i}', f'user{i}@example.com') for i in ids))
+        entitlements = pd.DataFrame({
+            'employee_id': np.repeat(ids, len(eleave.YEARS)),
+            'year': np.tile(eleave.YEARS, employees),
+            'days': np.repeat(rng.integers(5, 16, employees), len(eleave.YEARS)).astype(float),
+        })
+        eleave.save_entitlements(c, entitlements.astype(object).itertuples(index=False, name=None))
+        leaves = leave_frame(employees, years, records, seed)
+        eleave.insert_new_leaves(c, leaves[['employee_id', *eleave.LEAVE_COLUMNS]].astype(object)
+                                 .itertuples(index=False, name=None))
+        eleave.refresh_ledger(c)
+        eleave.bump_data_version(c)
+        conn.commit()
+        c.execute('PRAGMA optimize')
+    return len(leaves)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='输出的数据库文件（已存在则覆盖）')
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--years', type=int, default=3, help='休假记录分布的年度数（截至今年）')
+    parser.add_argument('--records', type=int, default=30, help='每名员工的休假记录数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    n = make_db(args.path, args.employees, args.years, args.records, args.seed)
+    print(f'{args.path}: {args.employees} 名员工，{n} 条休假记录，用时 {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""SQLite 数据访问层：连接池 + WAL 模式 + 调优 PRAGMA
+
+每个请求从池中借出一个长连接，请求结束后归还。连接长期复用，
+sqlite3 自带的语句缓存（cached_statements）因此可以跨请求命中，
+省去每次请求的连接建立与 SQL 重新编译开销。
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = 'leave_management.db'
+
+# 连接建立后逐条执行；journal_mode=WAL 写入数据库文件后持久生效，
+# 读者不再被写者阻塞（年假高峰期多 worker 并发时避免 "database is locked"）
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),   # WAL 下 NORMAL 已保证不损坏，仅掉电时可能丢最后一个事务
+    ('cache_size', -16000),      # 负数表示 KiB，约 16MB 页缓存
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),      # 写锁竞争时等待 5s 而不是立即报错
+)
+
+POOL_SIZE = 8
+CACHED_STATEMENTS = 256
+
+
+def connect(path, pragmas=PRAGMAS, factory=sqlite3.Connection):
+    """新建一个已应用 PRAGMA 的连接（可跨线程借用，但同一时刻只由一个线程使用）"""
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS, factory=factory)
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+class ConnectionPool:
+    """固定上限的空闲连接池；超出上限的连接归还时直接关闭"""
+
+    def __init__(self, path, size=POOL_SIZE, pragmas=PRAGMAS, factory=sqlite3.Connection):
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas
+        self.factory = factory
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_fork(self):
+        # 预派生（pre-fork）的 WSGI worker 不能继承父进程的连接
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue(maxsize=self.size)
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, self.pragmas, self.factory)
+
+    def release(self, conn):
+        # 归还前丢弃未提交的事务，避免把半截写入带给下一个请求
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid != os.getpid():
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """在请求之外（命令行、后台任务）借用连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, factory=sqlite3.Connection):
+    """按数据库路径取得（或创建）进程内共享的连接池；factory 为连接类，只在首次创建时生效"""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path, factory=factory)
+    return pool
+
+
+def schema_version(conn):
+    """当前已应用的最大迁移版本号（未初始化为 0）"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL)''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn, migrations):
+    """按版本号顺序执行尚未应用的迁移步骤 (version, name, func(cursor))
+
+    每一步在独立的 BEGIN IMMEDIATE 事务中执行：多个 worker 同时启动时，
+    只有拿到写锁的一个会真正执行，其余在锁释放后看到新版本号直接跳过。
+    返回本次实际执行的版本号列表。
+    """
+    applied = []
+    for version, name, step in sorted(migrations, key=lambda m: m[0]):
+        if version <= schema_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            step(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                         (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,140 @@
+"""导入用 Excel 读取：先只读表头以便尽早拒绝缺列的文件，再按块流式读取所需列
+
+安装了 python-calamine 时用它解析（Rust 实现，比 openpyxl 快一个数量级），否则用 openpyxl 只读模式
+逐行迭代，不把整个工作簿载入内存。多个工作表的大文件在子进程中并行解析，每个工作表一个进程。
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖
+    CalamineWorkbook = None
+
+CHUNK_ROWS = 5000
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024  # 小文件启动子进程的开销大于并行收益
+MAX_WORKERS = int(os.environ.get('ELEAVE_IMPORT_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+def _column_names(header):
+    """与 pd.read_excel 一致：空表头记为 Unnamed: n，重名列加 .1 / .2 后缀"""
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = f'Unnamed: {i}' if value is None or value == '' else str(value).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _sheet_rows(path, sheet):
+    """逐行产出工作表单元格值（tuple），第一行为表头；空单元格为 None"""
+    if CalamineWorkbook is not None:
+        for row in CalamineWorkbook.from_path(path).get_sheet_by_name(sheet).to_python(skip_empty_area=False):
+            # calamine 把数字都读成 float，整数还原成 int 与 openpyxl 一致（工号等显示为 1 而非 1.0）
+            yield tuple(None if v == '' else int(v) if isinstance(v, float) and v.is_integer() else v for v in row)
+        return
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb[sheet].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def sheet_headers(path):
+    """{工作表名: 列名列表}（按工作簿顺序），只读取每个工作表的第一行"""
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(path)
+        return {name: _column_names(next(iter(wb.get_sheet_by_name(name).to_python(nrows=1)), ()))
+                for name in wb.sheet_names}
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return {ws.title: _column_names(next(ws.iter_rows(max_row=1, values_only=True), ()))
+                for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def read_sheet(path, sheet, columns, chunk_filter=None, chunk_rows=CHUNK_ROWS):
+    """读取一个工作表中 columns {表头列名: 输出列名} 指定的列，返回 DataFrame（另含 excel_row：Excel 行号）
+
+    按 chunk_rows 行一块构建 DataFrame，全空行直接丢弃；chunk_filter(df) 可在每块上
+    提前过滤无效行，避免大文件的无用行堆积在内存中。
+    """
+    rows = _sheet_rows(path, sheet)
+    names = _column_names(next(rows, ()))
+    index = [names.index(col) for col in columns]
+    chunks, block, row_numbers = [], [], []
+
+    def flush():
+        df = pd.DataFrame(block, columns=list(columns.values()), dtype=object)
+        df['excel_row'] = row_numbers
+        chunks.append(chunk_filter(df) if chunk_filter else df)
+        block.clear()
+        row_numbers.clear()
+
+    for excel_row, row in enumerate(rows, 2):
+        values = tuple(row[i] if i < len(row) else None for i in index)
+        if all(v is None for v in values):
+            continue
+        block.append(values)
+        row_numbers.append(excel_row)
+        if len(block) >= chunk_rows:
+            flush()
+    if block or not chunks:
+        flush()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def drop_blank(column, df):
+    """chunk_filter 用：丢弃 column 为空或只有空白的行"""
+    text = df[column].astype(str).str.strip()
+    return df[df[column].notna() & (text != '')]
+
+
+def _read_sheet_job(args):
+    path, sheet, columns, chunk_filter = args
+    return read_sheet(path, sheet, columns, chunk_filter)
+
+
+def read_sheets(path, sheets, chunk_filter=None, workers=MAX_WORKERS):
+    """读取多个工作表 {工作表名: {表头列名: 输出列名}} 并按顺序拼接；多于一个工作表时 excel_row 带工作表名前缀
+
+    chunk_filter 可能在子进程中执行，须可 pickle（模块级函数或其 functools.partial）。
+    """
+    jobs = [(path, sheet, columns, chunk_filter) for sheet, columns in sheets.items()]
+    if len(jobs) > 1 and workers > 1 and os.path.getsize(path) >= PARALLEL_MIN_BYTES:
+        # spawn：Web 进程中有线程池与数据库连接，fork 出的子进程可能继承到持有中的锁
+        with ProcessPoolExecutor(min(workers, len(jobs)), mp_context=get_context('spawn')) as pool:
+            frames = list(pool.map(_read_sheet_job, jobs))
+    else:
+        frames = [_read_sheet_job(job) for job in jobs]
+    if len(frames) > 1:
+        for sheet, df in zip(sheets, frames):
+            df['excel_row'] = [f'{sheet}!{n}' for n in df['excel_row']]
+    return pd.concat(frames, ignore_index=True)
+
+
+@contextmanager
+def local_path(source):
+    """文件路径原样返回；上传的文件对象先落盘（子进程与 calamine 都按路径读取），用完删除"""
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as f:
+        source.seek(0)
+        shutil.copyfileobj(source, f)
+    try:
+        yield f.name
+    finally:
+        os.remove(f.name)
@@ -0,0 +1,102 @@
+"""进程内后台任务：导入 / 导出在线程池中执行，请求只负责提交并返回任务号
+
+任务状态保存在当前进程内存中，导出结果写入临时目录，超过有效期后连同文件一并清理。
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 3600  # 完成后保留 1 小时供下载
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'      # queued / running / done / failed
+        self.progress = 0.0         # 0 ~ 1
+        self.message = ''
+        self.result = None          # 任务返回值（如导入计数）
+        self.error = None
+        self.file_path = None       # 导出结果文件
+        self.download_name = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def update(self, progress=None, message=None):
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'kind': self.kind, 'status': self.status,
+            'progress': round(self.progress, 3), 'message': self.message,
+            'result': self.result, 'error': self.error,
+            'has_file': self.file_path is not None,
+            'created_at': self.created_at, 'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=2, ttl=JOB_TTL, store_dir=None):
+        self.ttl = ttl
+        self.store_dir = store_dir or tempfile.mkdtemp(prefix='eleave-jobs-')
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='eleave-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, job, filename):
+        """任务专属目录下的文件路径（上传的文件与导出结果都放这里）"""
+        job_dir = os.path.join(self.store_dir, job.id)
+        os.makedirs(job_dir, exist_ok=True)
+        return os.path.join(job_dir, filename)
+
+    def create(self, kind):
+        self.purge_expired()
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def start(self, job, func, *args, **kwargs):
+        """在线程池中执行 func(job, *args, **kwargs)，返回值写入 job.result"""
+        def run():
+            job.status = 'running'
+            try:
+                job.result = func(job, *args, **kwargs)
+                job.progress = 1.0
+                job.status = 'done'
+            except Exception as e:
+                logger.exception('后台任务 %s (%s) 失败', job.id, job.kind)
+                job.error = str(e) or e.__class__.__name__
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+        self._executor.submit(run)
+        return job
+
+    def submit(self, kind, func, *args, **kwargs):
+        return self.start(self.create(kind), func, *args, **kwargs)
+
+    def get(self, job_id):
+        self.purge_expired()
+        return self._jobs.get(job_id)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [j for j in self._jobs.values()
+                       if j.finished_at is not None and now - j.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(os.path.join(self.store_dir, job.id), ignore_errors=True)
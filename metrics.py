@@ -0,0 +1,235 @@
+"""请求级性能指标：墙钟耗时、SQL 语句数与耗时、pandas / openpyxl 耗时，以 Prometheus 文本格式输出
+
+SQL 计时通过 TracedConnection 实现：它作为 sqlite3 连接工厂返回计时游标，execute 记一条语句，
+随后的 fetch 耗时（SQLite 在取行时才逐步执行）累加到该语句上。只有当前线程存在活动的
+RequestTrace 时才记录，未启用指标时连接池使用普通连接，没有任何额外开销。
+指标保存在进程内，多进程部署时每个进程各自暴露，由 Prometheus 按实例汇总。
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_TRACED_STATEMENTS = 500  # 单个请求保留明细的语句数上限，超出部分只计数与计时
+
+_local = threading.local()
+
+
+class RequestTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.statements = []            # [[sql, 耗时秒], ...]，按执行顺序
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.sections = defaultdict(float)  # 'read_excel' / 'write_xlsx' / 'pandas' -> 秒
+        self._last = None                   # 最近一条保留明细的语句，fetch 耗时累加到它上面
+
+    def add_statement(self, sql, seconds):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        self._last = None
+        if len(self.statements) < MAX_TRACED_STATEMENTS:
+            self._last = [sql, seconds]
+            self.statements.append(self._last)
+
+    def add_fetch(self, seconds):
+        self.sql_seconds += seconds
+        if self._last is not None:
+            self._last[1] += seconds
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+
+def start_trace():
+    _local.trace = RequestTrace()
+    return _local.trace
+
+
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    if trace is not None:
+        trace.finished = time.perf_counter()
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def section(name):
+    """把代码块耗时记到当前请求的某一类别下（无活动请求时不计时）"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.sections[name] += time.perf_counter() - start
+
+
+class TracedCursor(sqlite3.Cursor):
+    def _run(self, func, sql, *args):
+        trace = current_trace()
+        if trace is None:
+            return func(sql, *args)
+        start = time.perf_counter()
+        try:
+            return func(sql, *args)
+        finally:
+            trace.add_statement(sql, time.perf_counter() - start)
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(super().executescript, sql_script)
+
+    def _fetch(self, func, *args):
+        trace = current_trace()
+        if trace is None:
+            return func(*args)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            trace.add_fetch(time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        return self._fetch(super().__next__)
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.connect(factory=...) 用的连接类：游标与 conn.execute 都经过计时游标"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class Registry:
+    """计数器与直方图，标签为 (endpoint, ...) 元组；render() 输出 Prometheus 文本格式"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters = defaultdict(float)     # (指标名, 标签元组) -> 值
+        self._histograms = {}                   # (指标名, 标签元组) -> [各桶计数..., 总和, 次数]
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels, value=1.0):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            h = self._histograms.get((name, labels))
+            if h is None:
+                h = self._histograms[(name, labels)] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def record(self, trace, endpoint, method, status, slow):
+        """一个请求结束：把 RequestTrace 汇总进各项指标"""
+        self.inc('eleave_requests_total', (('endpoint', endpoint), ('method', method), ('status', str(status))))
+        self.observe('eleave_request_duration_seconds', (('endpoint', endpoint),), trace.elapsed())
+        self.inc('eleave_sql_statements_total', (('endpoint', endpoint),), trace.sql_count)
+        self.inc('eleave_sql_seconds_total', (('endpoint', endpoint),), trace.sql_seconds)
+        for name, seconds in trace.sections.items():
+            self.inc('eleave_section_seconds_total', (('endpoint', endpoint), ('section', name)), seconds)
+        if slow:
+            self.inc('eleave_slow_requests_total', (('endpoint', endpoint),))
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        lines, seen = [], set()
+
+        def header(name):
+            if name not in seen and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+            seen.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f'{name}{_labels(labels)} {value:g}')
+        for (name, labels), h in histograms:
+            header(name)
+            for bound, count in zip(self.buckets, h):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", f"{bound:g}"),))} {count}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {h[-1]}')
+            lines.append(f'{name}_sum{_labels(labels)} {h[-2]:g}')
+            lines.append(f'{name}_count{_labels(labels)} {h[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def default_registry():
+    registry = Registry()
+    registry.describe('eleave_requests_total', 'counter', 'Requests by endpoint, method and status.')
+    registry.describe('eleave_request_duration_seconds', 'histogram', 'Request wall time, including streamed bodies.')
+    registry.describe('eleave_sql_statements_total', 'counter', 'SQL statements executed.')
+    registry.describe('eleave_sql_seconds_total', 'counter', 'Time spent executing SQL and fetching rows.')
+    registry.describe('eleave_section_seconds_total', 'counter', 'Time spent in pandas / openpyxl sections.')
+    registry.describe('eleave_slow_requests_total', 'counter', 'Requests slower than ELEAVE_SLOW_REQUEST_MS.')
+    return registry
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def format_slow_request(trace, request_line, limit=50, sql_width=200):
+    """慢请求日志：总耗时、SQL 汇总、各分段耗时，以及按耗时排序的前 limit 条语句"""
+    parts = [f'{request_line} {trace.elapsed() * 1000:.0f}ms',
+             f'sql={trace.sql_count} ({trace.sql_seconds * 1000:.0f}ms)']
+    parts += [f'{name}={seconds * 1000:.0f}ms' for name, seconds in sorted(trace.sections.items())]
+    lines = [' '.join(parts)]
+    for sql, seconds in sorted(trace.statements, key=lambda s: -s[1])[:limit]:
+        text = _WHITESPACE_RE.sub(' ', sql).strip()
+        if len(text) > sql_width:
+            text = text[:sql_width] + '…'
+        lines.append(f'  {seconds * 1000:8.1f}ms  {text}')
+    return '\n'.join(lines)
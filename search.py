@@ -0,0 +1,34 @@
+"""休假记录全文检索（SQLite FTS5）的分词与查询构造
+
+FTS5 自带的 unicode61 分词器把连续的汉字当作一个词，「做手术后休养」无法用「手术」检索到。
+写入索引前用 fts_tokens() 在每个汉字两侧加空格，使每个汉字成为一个词；检索时汉字串转成相邻词组
+（phrase），即按原文连续出现匹配。
+"""
+import re
+
+_CJK_RE = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])')
+_TOKEN_RE = re.compile(r'[^\W_]+')  # 与 unicode61 一致：字母、数字为词，其余（含下划线）为分隔符
+
+
+def fts_tokens(text):
+    """写入 FTS 索引的文本：汉字逐字以空格分隔，其余原样（由 unicode61 按标点与空白切分）"""
+    if text is None:
+        return None
+    return _CJK_RE.sub(r' \1 ', str(text))
+
+
+def match_query(text):
+    """把用户输入转成 FTS5 查询：空白分隔的各词须同时出现；汉字按原文连续匹配，字母数字词按前缀匹配
+
+    只保留字母数字并加引号，用户输入中的 FTS5 运算符（AND / OR / NEAR / 引号 / 星号）按普通文本处理。
+    输入中没有可检索的内容时返回 None。
+    """
+    terms = []
+    for word in text.split():
+        tokens = _TOKEN_RE.findall(fts_tokens(word))
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        # 最后一个词是字母数字时按前缀匹配（如邮箱 user12 匹配 user123）
+        terms.append(phrase + '*' if tokens[-1].isascii() else phrase)
+    return ' '.join(terms) or None
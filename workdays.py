@@ -0,0 +1,42 @@
+"""工作日历：按起止日期与上午/下午计算休假的工作日天数
+
+周一至周五为工作日；法定假日放在 numpy 的 busdaycalendar 中，调休上班的周末另存一个有序数组，
+区间内工作日数 = busday_count + 区间内调休上班日数，两者都支持整列数组一次计算。
+"""
+import numpy as np
+
+
+class WorkdayCalendar:
+    def __init__(self, holidays=(), makeup_days=()):
+        self._busdays = np.busdaycalendar(holidays=np.asarray(holidays, dtype='datetime64[D]'))
+        makeup = np.asarray(makeup_days, dtype='datetime64[D]')
+        # 只保留本来不是工作日的调休日（周末），避免与 busday_count 重复计数
+        self._makeup = np.sort(makeup[~np.is_busday(makeup)])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由 Holidays 表的 (day, is_workday) 行构建"""
+        holidays = [day for day, is_workday in rows if not is_workday]
+        makeup = [day for day, is_workday in rows if is_workday]
+        return cls(holidays, makeup)
+
+    def is_workday(self, days):
+        days = np.asarray(days, dtype='datetime64[D]')
+        return np.is_busday(days, busdaycal=self._busdays) | np.isin(days, self._makeup)
+
+    def count(self, start, end):
+        """[start, end] 两端都含的工作日数；end 早于 start 时为 0"""
+        start = np.asarray(start, dtype='datetime64[D]')
+        end = np.asarray(end, dtype='datetime64[D]')
+        stop = np.maximum(end + 1, start)
+        makeup = np.searchsorted(self._makeup, stop, 'left') - np.searchsorted(self._makeup, start, 'left')
+        return np.busday_count(start, stop, busdaycal=self._busdays) + makeup
+
+    def leave_days(self, start, start_pm, end, end_am):
+        """休假天数：区间内工作日数，开始于下午、结束于上午且当天为工作日时各减 0.5 天"""
+        start = np.asarray(start, dtype='datetime64[D]')
+        end = np.asarray(end, dtype='datetime64[D]')
+        days = (self.count(start, end)
+                - 0.5 * (np.asarray(start_pm, dtype=bool) & self.is_workday(start))
+                - 0.5 * (np.asarray(end_am, dtype=bool) & self.is_workday(end)))
+        return np.maximum(days, 0.0)